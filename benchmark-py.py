@@ -0,0 +1,488 @@
+"""Micro-benchmarks for ViralCraft AI hot paths.
+
+Run from the project root, e.g.:
+
+    python benchmark.py classifier
+    python benchmark.py passwords --workers 4
+    python benchmark.py startup
+    python benchmark.py endpoints --concurrency 16 --save-baseline baseline.json
+    python benchmark.py endpoints --baseline baseline.json
+    python benchmark.py popularity --elements 10000
+    python benchmark.py trending --elements 10000,100000
+    python benchmark.py scoring --prompts 10000
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE_PROMPTS = [
+    'A funny reaction to trying a new food trend',
+    'Dance challenge with my pet dog',
+    'Tutorial on organizing your room in 60 seconds',
+    'How to do a five minute makeup look for school',
+    'My cat judging my cooking skills',
+    'Reviewing the most viral gadgets of the year',
+    'Morning routine of a busy entrepreneur in the city',
+    'Explaining quantum physics to my grandma with education memes',
+    'Learn three easy guitar chords before breakfast',
+    'Home decor haul from the thrift store on a budget'
+]
+
+
+def legacy_get_content_category(prompt):
+    """Substring-scanning classifier kept as the benchmark reference"""
+    prompt_lower = prompt.lower()
+
+    if any(word in prompt_lower for word in ['dance', 'dancing', 'choreography', 'moves']):
+        return 'dance'
+    elif any(word in prompt_lower for word in ['food', 'cooking', 'recipe', 'eating', 'taste']):
+        return 'food'
+    elif any(word in prompt_lower for word in ['tutorial', 'how to', 'learn', 'teach', 'guide']):
+        return 'tutorial'
+    elif any(word in prompt_lower for word in ['pet', 'dog', 'cat', 'animal']):
+        return 'pet'
+    elif any(word in prompt_lower for word in ['reaction', 'react', 'respond', 'review']):
+        return 'reaction'
+    elif any(word in prompt_lower for word in ['makeup', 'beauty', 'skincare', 'outfit']):
+        return 'beauty'
+    elif any(word in prompt_lower for word in ['room', 'home', 'decor', 'organize']):
+        return 'lifestyle'
+    elif any(word in prompt_lower for word in ['funny', 'comedy', 'joke', 'humor']):
+        return 'comedy'
+    else:
+        return 'general'
+
+
+def _report(name, seconds, count):
+    per_item = seconds / count * 1e6
+    print(f"  {name:<28} {per_item:8.2f} us/prompt  {count / seconds:12,.0f} prompts/s")
+
+
+def bench_classifier(args):
+    from src.services.classifier import content_classifier
+
+    rng = random.Random(42)
+    short_prompts = [rng.choice(SAMPLE_PROMPTS) for _ in range(args.prompts)]
+    # Captions and scripts pasted as prompts are much longer than a one-liner
+    long_prompts = [' '.join(rng.sample(SAMPLE_PROMPTS, 6)) for _ in range(args.prompts)]
+
+    for label, prompts in (('short', short_prompts), ('long', long_prompts)):
+        print(f"Classifying {len(prompts)} {label} prompts, best of {args.repeat} runs")
+        legacy = min(timeit.repeat(
+            lambda: [legacy_get_content_category(p) for p in prompts], number=1, repeat=args.repeat))
+        current = min(timeit.repeat(
+            lambda: [content_classifier.classify(p) for p in prompts], number=1, repeat=args.repeat))
+        batch = min(timeit.repeat(
+            lambda: content_classifier.classify_many(prompts), number=1, repeat=args.repeat))
+        assert content_classifier.classify_many(prompts) == [content_classifier.classify(p) for p in prompts]
+
+        _report('legacy substring scan', legacy, len(prompts))
+        _report('whole-word scan classify()', current, len(prompts))
+        _report('classify_many()', batch, len(prompts))
+        print(f"  speedup (classify vs legacy): {legacy / current:.2f}x")
+        print(f"  speedup (classify_many vs legacy): {legacy / batch:.2f}x")
+
+    changed = [p for p in SAMPLE_PROMPTS if legacy_get_content_category(p) != content_classifier.classify(p)]
+    for prompt in changed:
+        print(f"note: {prompt!r}: {legacy_get_content_category(prompt)} -> {content_classifier.classify(prompt)}")
+
+
+def bench_passwords(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from src.services.passwords import PasswordHasher
+    import time
+
+    cores = os.cpu_count() or 1
+    hasher = PasswordHasher(method=args.method, workers=args.workers, max_pending=args.hashes)
+    print(f"Hashing with {hasher.current_params}, {cores} CPU cores")
+
+    start = time.perf_counter()
+    for _ in range(args.hashes):
+        hasher.hash('correct horse battery staple')
+    single = args.hashes / (time.perf_counter() - start)
+    print(f"  1 request thread:   {single:8.1f} hashes/s")
+
+    # Many request threads sharing the pool, as under a registration burst
+    with ThreadPoolExecutor(max_workers=args.workers * 2) as requests:
+        start = time.perf_counter()
+        list(requests.map(lambda _: hasher.hash('correct horse battery staple'), range(args.hashes)))
+        pooled = args.hashes / (time.perf_counter() - start)
+    print(f"  pool of {args.workers} workers: {pooled:8.1f} hashes/s")
+    print(f"  per core:           {pooled / min(args.workers, cores):8.1f} hashes/s")
+    print(f"One hashing thread handles ~{pooled / args.workers:.1f} sign-ins/s; with threaded gunicorn "
+          "workers size PASSWORD_HASH_WORKERS to match peak load")
+
+
+def bench_startup(args):
+    import statistics
+    import subprocess
+    import time
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, SCHEMA_AUTO_CREATE='1')
+
+    def spawn(code):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=root, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        return (time.perf_counter() - start) * 1000
+
+    interpreter = [spawn('pass') for _ in range(args.runs)]
+    cold = [spawn('import main') for _ in range(args.runs)]
+    print(f"Cold start over {args.runs} runs (median):")
+    print(f"  python interpreter   {statistics.median(interpreter):8.1f} ms")
+    print(f"  import main          {statistics.median(cold):8.1f} ms")
+    print(f"  app cost             {statistics.median(cold) - statistics.median(interpreter):8.1f} ms")
+
+    # Per-phase breakdown of one create_app() call in this process
+    import main as app_module
+    print(app_module.app.extensions['startup_report'].report())
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class _TestClientTransport:
+    """Drives the app in-process through Flask test clients (one per thread)"""
+
+    def __init__(self):
+        import threading
+        import main as app_module
+
+        self.app = app_module.app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers or {})
+        data = response.get_json(silent=True)
+        response.close()
+        return response.status_code, data
+
+
+class _HttpTransport:
+    """Drives a running server over HTTP"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None, headers=None):
+        import json
+        import urllib.error
+        import urllib.request
+
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                payload = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            payload = e.read()
+            status = e.code
+        try:
+            return status, json.loads(payload)
+        except ValueError:
+            return status, None
+
+
+def _endpoint_scenarios(auth_headers, run_id):
+    """(name, method, path, body factory, headers) for every registered endpoint"""
+    counter = iter(range(10 ** 9))
+    prompt = 'Dance challenge with my pet dog in the kitchen while cooking'
+    batch = [f'{p} #{i}' for i, p in enumerate(SAMPLE_PROMPTS * 5)]
+
+    def fresh(prompts):
+        # Unique per request, so the generation cache never answers
+        n = next(counter)
+        return [f'{p} {run_id} {n}' for p in prompts]
+
+    return [
+        ('health', 'GET', '/api/health', None, None),
+        ('generate-video', 'POST', '/api/generate-video', lambda: {'prompt': fresh([prompt])[0]}, None),
+        # The same prompt every time: all but the first request are cache hits
+        ('generate-video-cached', 'POST', '/api/generate-video', lambda: {'prompt': prompt}, None),
+        ('generate-video-batch', 'POST', '/api/generate-video/batch', lambda: {'prompts': fresh(batch)}, None),
+        ('generate-video-batch-cached', 'POST', '/api/generate-video/batch', lambda: {'prompts': batch}, None),
+        ('trending-elements', 'GET', '/api/trending-elements', None, None),
+        ('analytics', 'GET', '/api/analytics', None, None),
+        ('register', 'POST', '/api/register',
+         lambda: {'username': f'bench{run_id}_{next(counter)}', 'email': f'b{run_id}_{next(counter)}@example.com',
+                  'password': 'benchmark-password'}, None),
+        ('login', 'POST', '/api/login',
+         lambda: {'username': f'bench{run_id}', 'password': 'benchmark-password'}, None),
+        ('profile', 'GET', '/api/profile', None, auth_headers),
+        ('history', 'GET', '/api/history', None, auth_headers),
+        ('subscription', 'GET', '/api/subscription', None, auth_headers),
+        ('static', 'GET', '/', None, None)
+    ]
+
+
+def _run_scenario(transport, scenario, total, concurrency):
+    from concurrent.futures import ThreadPoolExecutor
+    import time
+
+    name, method, path, body, headers = scenario
+    latencies = []
+    errors = 0
+
+    def one(_):
+        start = time.perf_counter()
+        status, _ = transport.request(method, path, body() if body else None, headers)
+        return (time.perf_counter() - start) * 1000, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, status in pool.map(one, range(total)):
+            latencies.append(latency)
+            # The SPA route legitimately 404s when no frontend is built
+            if status >= 500 or (status >= 400 and name != 'static'):
+                errors += 1
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'errors': errors,
+        'rps': total / elapsed,
+        'p50': _percentile(latencies, 50),
+        'p95': _percentile(latencies, 95),
+        'p99': _percentile(latencies, 99)
+    }
+
+
+def bench_endpoints(args):
+    import json
+    import tempfile
+
+    if not args.simulate:
+        os.environ['SIMULATE_PROCESSING'] = '0'
+    # Every request comes from one client, which the free plan would throttle
+    os.environ.setdefault('QUOTAS_ENABLED', '0')
+
+    if args.url:
+        transport = _HttpTransport(args.url)
+    else:
+        # Keep benchmark users out of the real database
+        os.environ.setdefault('DATABASE_URL', f"sqlite:///{tempfile.mkdtemp()}/benchmark.db")
+        transport = _TestClientTransport()
+
+    run_id = random.randint(0, 10 ** 6)
+    status, data = transport.request('POST', '/api/register', {
+        'username': f'bench{run_id}', 'email': f'bench{run_id}@example.com', 'password': 'benchmark-password'})
+    token = (data or {}).get('token')
+    if not token:
+        print(f"Could not register a benchmark user ({status}), authenticated routes will fail")
+    auth_headers = {'Authorization': f'Bearer {token}'}
+
+    scenarios = _endpoint_scenarios(auth_headers, run_id)
+    if args.endpoints:
+        wanted = set(args.endpoints.split(','))
+        scenarios = [s for s in scenarios if s[0] in wanted]
+
+    target = args.url or 'Flask test client'
+    print(f"{target}: {args.requests} requests per endpoint, concurrency {args.concurrency}")
+    print(f"  {'endpoint':<28} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    results = {}
+    for scenario in scenarios:
+        # Password hashing dominates these, keep them short
+        total = min(args.requests, 20) if scenario[0] in ('register', 'login') else args.requests
+        result = results[scenario[0]] = _run_scenario(transport, scenario, total, args.concurrency)
+        print(f"  {scenario[0]:<28} {result['rps']:9.1f} {result['p50']:9.2f} {result['p95']:9.2f} "
+              f"{result['p99']:9.2f} {result['errors']:7d}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if not before:
+                continue
+            if result['p95'] > before['p95'] * (1 + args.max_regression):
+                regressions.append(f"{name}: p95 {before['p95']:.2f} -> {result['p95']:.2f} ms")
+            if result['rps'] < before['rps'] * (1 - args.max_regression):
+                regressions.append(f"{name}: throughput {before['rps']:.1f} -> {result['rps']:.1f} req/s")
+        if regressions:
+            print(f"Regressions beyond {args.max_regression:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.max_regression:.0%} against {args.baseline}")
+
+
+def bench_popularity(args):
+    import time
+    from src.services.popularity import PopularitySeries
+
+    series = PopularitySeries(window=args.window)
+    rng = random.Random(42)
+    now = time.time()
+    for i in range(args.elements):
+        base, trend = rng.uniform(40, 95), rng.uniform(-2, 2)
+        for j in range(args.window):
+            intervals_ago = args.window - j
+            series.add(f'element-{i}', base + trend * j + rng.uniform(-1, 1),
+                       now - intervals_ago * series.sample_interval)
+
+    print(f"Ranking {args.elements} elements x {args.window} samples, best of {args.repeat} runs")
+    for label, by in (('top 10 by decayed score', 'score'), ('top 10 rising', 'velocity')):
+        seconds = min(timeit.repeat(lambda: series.rank(10, by=by, now=now), number=1, repeat=args.repeat))
+        print(f"  {label:<28} {seconds * 1000:8.2f} ms")
+
+
+def bench_trending(args):
+    import heapq
+    import time
+    from src.services.trends import TrendIndex
+
+    types = ('sound', 'effect', 'meme')
+    categories = [f'category-{i}' for i in range(20)]
+    for count in (int(n) for n in args.elements.split(',')):
+        rng = random.Random(42)
+        rows = [{'name': f'element-{i}', 'type': rng.choice(types), 'category': rng.choice(categories),
+                 'popularity': rng.uniform(0, 100)} for i in range(count)]
+
+        index = TrendIndex()
+        start = time.perf_counter()
+        index.load(rows)
+        load = time.perf_counter() - start
+
+        def order_by():
+            # What a query without an index does: sort every matching row on each call
+            return sorted((r for r in rows if r['type'] == 'sound'), key=lambda r: r['popularity'], reverse=True)[:args.k]
+
+        def nlargest():
+            return heapq.nlargest(args.k, (r for r in rows if r['type'] == 'sound'), key=lambda r: r['popularity'])
+
+        assert [r['name'] for r in index.top('sound', args.k)] == [r['name'] for r in order_by()]
+
+        print(f"Top {args.k} of {count} elements, best of {args.repeat} runs (index built in {load * 1000:.0f} ms)")
+        for label, func in (('sort all rows', order_by),
+                            ('heapq.nlargest', nlargest),
+                            ('TrendIndex.top(type)', lambda: index.top('sound', args.k)),
+                            ('TrendIndex.top(type, category)', lambda: index.top('sound', args.k, 'category-3'))):
+            seconds = min(timeit.repeat(func, number=10, repeat=args.repeat)) / 10
+            print(f"  {label:<32} {seconds * 1e6:10.1f} us/query")
+
+        updates = [dict(rng.choice(rows), popularity=rng.uniform(0, 100)) for _ in range(1000)]
+        start = time.perf_counter()
+        for row in updates:
+            index.upsert(row)
+        print(f"  {'popularity update (upsert)':<32} {(time.perf_counter() - start) / len(updates) * 1e6:10.1f} us/update")
+
+
+def legacy_viral_score(prompt, content_category, applied_trends):
+    """The if-chain the scoring model replaced, without its random bonus"""
+    base_score = 70
+    if len(prompt) > 50:
+        base_score += 10
+    if content_category in ['dance', 'food', 'pet']:
+        base_score += 5
+    if len(applied_trends) >= 2:
+        base_score += 8
+    return base_score
+
+
+def bench_scoring(args):
+    import numpy as np
+    from src.services.classifier import content_classifier
+    from src.services.scoring import ViralScoreModel
+
+    model = ViralScoreModel(path=os.devnull)
+    model.reset()
+    rng = random.Random(42)
+    prompts = [rng.choice(SAMPLE_PROMPTS) + ' ' * rng.randint(0, 30) for _ in range(args.prompts)]
+    categories = [content_classifier.classify(p) for p in prompts]
+    trend_lists = [[{'popularity': rng.uniform(50, 100)} for _ in range(rng.randint(0, 3))] for _ in prompts]
+
+    legacy = [legacy_viral_score(p, c, t) for p, c, t in zip(prompts, categories, trend_lists)]
+    assert np.array_equal(model.score_many(prompts, categories, trend_lists), legacy)
+
+    print(f"Scoring {len(prompts)} prompts, best of {args.repeat} runs")
+    for label, func in (
+            ('legacy if-chain', lambda: [legacy_viral_score(p, c, t) for p, c, t in zip(prompts, categories, trend_lists)]),
+            ('model.score() per prompt', lambda: [model.score(p, c, t) for p, c, t in zip(prompts, categories, trend_lists)]),
+            ('model.score_many() batch', lambda: model.score_many(prompts, categories, trend_lists))):
+        _report(label, min(timeit.repeat(func, number=1, repeat=args.repeat)), len(prompts))
+
+    from src.services.scoring import feature_matrix
+    matrix = feature_matrix(prompts, categories, trend_lists)
+    seconds = min(timeit.repeat(lambda: model.predict(matrix), number=1, repeat=args.repeat))
+    _report('matrix product only', seconds, len(prompts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ViralCraft AI benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    classifier = subparsers.add_parser('classifier', help='content category classifier')
+    classifier.add_argument('--prompts', type=int, default=10000)
+    classifier.add_argument('--repeat', type=int, default=5)
+    classifier.set_defaults(func=bench_classifier)
+
+    passwords = subparsers.add_parser('passwords', help='password hashing throughput')
+    passwords.add_argument('--method', default=None, help='defaults to PASSWORD_HASH_METHOD')
+    passwords.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    passwords.add_argument('--hashes', type=int, default=20)
+    passwords.set_defaults(func=bench_passwords)
+
+    startup = subparsers.add_parser('startup', help='worker cold start time')
+    startup.add_argument('--runs', type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    endpoints = subparsers.add_parser('endpoints', help='load test every API endpoint')
+    endpoints.add_argument('--url', help='base URL of a running server (default: in-process test client)')
+    endpoints.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    endpoints.add_argument('--concurrency', type=int, default=8)
+    endpoints.add_argument('--endpoints', help='comma-separated subset, e.g. health,generate-video')
+    endpoints.add_argument('--simulate', action='store_true', help='keep the simulated 2-4s processing delay')
+    endpoints.add_argument('--save-baseline', metavar='FILE')
+    endpoints.add_argument('--baseline', metavar='FILE', help='fail if results regress against FILE')
+    endpoints.add_argument('--max-regression', type=float, default=0.25,
+                           help='allowed p95/throughput regression as a fraction (default 0.25)')
+    endpoints.set_defaults(func=bench_endpoints)
+
+    popularity = subparsers.add_parser('popularity', help='trending element ranking')
+    popularity.add_argument('--elements', type=int, default=10000)
+    popularity.add_argument('--window', type=int, default=48)
+    popularity.add_argument('--repeat', type=int, default=5)
+    popularity.set_defaults(func=bench_popularity)
+
+    trending = subparsers.add_parser('trending', help='top-k trending element queries')
+    trending.add_argument('--elements', default='10000,100000', help='comma-separated catalog sizes')
+    trending.add_argument('--k', type=int, default=5)
+    trending.add_argument('--repeat', type=int, default=5)
+    trending.set_defaults(func=bench_trending)
+
+    scoring = subparsers.add_parser('scoring', help='viral score model, single vs batch')
+    scoring.add_argument('--prompts', type=int, default=10000)
+    scoring.add_argument('--repeat', type=int, default=5)
+    scoring.set_defaults(func=bench_scoring)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+
+class SnapshotCache:
+    """Serve a JSON payload built at most once per TTL, with a strong ETag"""
+
+    def __init__(self, builder, ttl):
+        self.builder = builder
+        self.ttl = ttl
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        body = (current_app.json.dumps(self.builder()) + '\n').encode('utf-8')
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        return body, etag, time.monotonic() + self.ttl
+
+    def snapshot(self):
+        """Return (body, etag, expires_at), rebuilding the payload when it is stale"""
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[2] <= time.monotonic():
+            with self._lock:
+                # Another thread may have rebuilt it while we waited
+                snapshot = self._snapshot
+                if snapshot is None or snapshot[2] <= time.monotonic():
+                    snapshot = self._snapshot = self._build()
+        return snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def response(self):
+        """Cached payload for the current request, or 304 if the client has it"""
+        body, etag, expires_at = self.snapshot()
+        max_age = max(0, int(expires_at - time.monotonic()))
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f'public, max-age={max_age}'
+        return response
+
+
+class ResultCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached value for a key, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                    self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
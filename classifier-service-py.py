@@ -0,0 +1,105 @@
+import re
+
+# Category keywords in priority order: when a prompt matches several
+# categories the one listed first wins
+CATEGORY_KEYWORDS = [
+    ('dance', ['dance', 'dancing', 'choreography', 'moves']),
+    ('food', ['food', 'cooking', 'recipe', 'eating', 'taste']),
+    ('tutorial', ['tutorial', 'how to', 'learn', 'teach', 'guide']),
+    ('pet', ['pet', 'dog', 'cat', 'animal']),
+    ('reaction', ['reaction', 'react', 'respond', 'review']),
+    ('beauty', ['makeup', 'beauty', 'skincare', 'outfit']),
+    ('lifestyle', ['room', 'home', 'decor', 'organize']),
+    ('comedy', ['funny', 'comedy', 'joke', 'humor'])
+]
+
+DEFAULT_CATEGORY = 'general'
+
+# A word is a run of word characters, the same boundary the keyword match uses
+_WORD_RE = re.compile(r'\w+')
+
+
+def _inflections(word):
+    """Yield the keyword plus the plural/verb forms folded onto it"""
+    yield word
+    yield word + 's'
+    yield word + 'es'
+    yield word + 'ed'
+    yield word + 'ing'
+    if word.endswith('e'):
+        yield word + 'd'
+        yield word[:-1] + 'ing'
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+def tokenize(text):
+    """Lowercase words of a text, split like keyword matches ("dog's" -> "dog", "s")"""
+    return _WORD_RE.findall(text.lower())
+
+
+class KeywordClassifier:
+    """Keyword classifier that checks categories in priority order
+
+    Each keyword is located with a plain substring search on its stem (the
+    part every inflection starts with, e.g. "danc"), just like the original
+    scan, and a hit is only accepted when it is a whole word: the keyword or
+    one of its inflections, optionally followed by a possessive, so "dog's"
+    is a pet but "education" is not. The first accepted keyword wins, so a
+    prompt costs a few substring searches whatever its length.
+    """
+
+    def __init__(self, category_keywords, default=DEFAULT_CATEGORY):
+        self.default = default
+        self.categories = [category for category, _ in category_keywords]
+
+        # Exact keywords are assigned first so an inflected form never
+        # shadows a keyword listed under a lower priority category
+        owner = {}
+        for exact in (True, False):
+            for priority, (_, keywords) in enumerate(category_keywords):
+                for keyword in keywords:
+                    keyword = keyword.lower()
+                    for form in ([keyword] if exact or ' ' in keyword else _inflections(keyword)):
+                        owner.setdefault(form, priority)
+
+        # (priority, stem, pattern matching a whole form at the stem) in priority order
+        self._checks = []
+        for priority, (_, keywords) in enumerate(category_keywords):
+            for keyword in keywords:
+                keyword = keyword.lower()
+                forms = [keyword] if ' ' in keyword else [f for f in _inflections(keyword) if owner[f] == priority]
+                if not forms:
+                    continue
+                # Every form starts with the stem: "danc" for "dancing", "how" for "how to"
+                stem = keyword.split()[0]
+                if ' ' not in keyword and stem.endswith('e'):
+                    stem = stem[:-1]
+                alternatives = '|'.join(re.escape(form).replace(r'\ ', r'\s+')
+                                        for form in sorted(forms, key=len, reverse=True))
+                self._checks.append((priority, stem, re.compile(f'(?:{alternatives})\\b')))
+
+    def classify(self, prompt):
+        """Return the highest priority category with a whole-word keyword match"""
+        prompt_lower = prompt.lower()
+        for priority, stem, pattern in self._checks:
+            if stem not in prompt_lower:
+                continue
+            start = prompt_lower.find(stem)
+            while start != -1:
+                if (start == 0 or not _is_word_char(prompt_lower[start - 1])) and pattern.match(prompt_lower, start):
+                    return self.categories[priority]
+                start = prompt_lower.find(stem, start + 1)
+        return self.default
+
+    def classify_many(self, prompts):
+        """Classify a batch of prompts, returning their categories in order"""
+        classify = self.classify
+        return [classify(prompt) for prompt in prompts]
+
+
+content_classifier = KeywordClassifier(CATEGORY_KEYWORDS)
+
+classify = content_classifier.classify
@@ -1,139 +1,352 @@
 import os
 import sys
-from flask import Flask, send_from_directory, jsonify
-from flask_cors import CORS
+import threading
+import time
+from flask import Flask, jsonify
+from sqlalchemy import event
 
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-# Create the src directory structure if it doesn't exist
-src_dir = os.path.join(os.path.dirname(__file__), 'src')
-routes_dir = os.path.join(src_dir, 'routes')
-models_dir = os.path.join(src_dir, 'models')
+def get_database_uri():
+    """Database URL from DATABASE_URL, with relative SQLite paths resolved against the app directory"""
+    uri = os.environ.get('DATABASE_URL', 'sqlite:///database/app.db')
+    
+    # Heroku-style URLs are not accepted by SQLAlchemy
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    
+    if uri.startswith('sqlite:///') and not uri.startswith('sqlite:////') and ':memory:' not in uri:
+        uri = f"sqlite:///{os.path.join(os.path.dirname(__file__), uri[len('sqlite:///'):])}"
+    
+    return uri
 
-for directory in [src_dir, routes_dir, models_dir]:
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+def get_sqlite_pragmas():
+    """PRAGMAs applied to every new SQLite connection"""
+    return {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))
+    }
 
-# Create __init__.py files if they don't exist
-for directory in [src_dir, routes_dir, models_dir]:
-    init_file = os.path.join(directory, '__init__.py')
-    if not os.path.exists(init_file):
-        with open(init_file, 'w') as f:
-            f.write('')
+def get_engine_options(uri):
+    """SQLAlchemy engine options for the configured database"""
+    if uri.startswith('sqlite'):
+        # Python's sqlite3 timeout is the busy timeout in seconds
+        return {'connect_args': {'timeout': get_sqlite_pragmas()['busy_timeout'] / 1000}}
+    
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True
+    }
 
-try:
-    from src.routes.user import user_bp
-except ImportError:
-    print("Warning: user routes not found, creating minimal blueprint")
-    from flask import Blueprint
-    user_bp = Blueprint('user', __name__)
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in get_sqlite_pragmas().items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
 
-try:
-    from src.routes.video import video_bp
-except ImportError:
-    print("Warning: video routes not found, creating minimal blueprint")
-    from flask import Blueprint
-    video_bp = Blueprint('video', __name__)
+def describe_database(engine):
+    """One-line summary of the effective database settings"""
+    url = engine.url.render_as_string(hide_password=True)
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as connection:
+            settings = {
+                name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name in get_sqlite_pragmas()
+            }
+    else:
+        pool = engine.pool
+        settings = {
+            'pool_size': pool.size() if hasattr(pool, 'size') else None,
+            'pool_recycle': getattr(pool, '_recycle', None),
+            'pool_pre_ping': getattr(pool, '_pre_ping', None)
+        }
+    return f"{url} ({', '.join(f'{k}={v}' for k, v in settings.items())})"
 
-# Try to import database models
-try:
+def create_schema(app):
+    """Create missing tables and indexes; safe to run repeatedly"""
     from src.models.user import db
-    DB_AVAILABLE = True
-except ImportError:
-    print("Warning: Database models not found, running without database")
-    DB_AVAILABLE = False
-    db = None
-
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+    
+    with app.app_context():
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        if uri.startswith('sqlite:///') and ':memory:' not in uri:
+            database_dir = os.path.dirname(uri[len('sqlite:///'):])
+            if database_dir and not os.path.exists(database_dir):
+                os.makedirs(database_dir)
+        db.create_all()
+        # create_all skips tables that already exist, so indexes added to
+        # the models later are created here, each only if it is missing
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+    print("Database initialized successfully")
 
-# Configuration
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+def start_worker(app):
+    """Per-process database setup: load the trend index and log the effective settings"""
+    from src.models.user import db
+    from src.services.trends import sync_with_database
+    
+    with app.app_context():
+        loaded = sync_with_database()
+        print(f"Database: {describe_database(db.engine)}")
+    if loaded:
+        print(f"Trend index loaded {loaded} trending elements")
 
-# Enable CORS for all routes
-CORS(app, origins=['*'])
+class _StartupTimer:
+    """Collects how long each create_app phase takes"""
+    
+    def __init__(self):
+        self.phases = []
+        self._last = time.perf_counter()
+    
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self._last) * 1000))
+        self._last = now
+    
+    def report(self):
+        total = sum(ms for _, ms in self.phases)
+        lines = [f"  {phase:<16} {ms:8.1f} ms" for phase, ms in self.phases]
+        return "\n".join(["⏱️  Startup:"] + lines + [f"  {'total':<16} {total:8.1f} ms"])
 
-# Register blueprints
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(video_bp, url_prefix='/api')
+def _load_blueprints():
+    try:
+        from src.routes.user import user_bp
+    except ImportError:
+        print("Warning: user routes not found, creating minimal blueprint")
+        from flask import Blueprint
+        user_bp = Blueprint('user', __name__)
+    
+    try:
+        from src.routes.video import video_bp
+    except ImportError:
+        print("Warning: video routes not found, creating minimal blueprint")
+        from flask import Blueprint
+        video_bp = Blueprint('video', __name__)
+    
+    return user_bp, video_bp
 
-# Database setup (only if available)
-if DB_AVAILABLE and db is not None:
-    database_dir = os.path.join(os.path.dirname(__file__), 'database')
-    if not os.path.exists(database_dir):
-        os.makedirs(database_dir)
+def _init_database(app):
+    """Configure the database extension; connects and creates tables only on first use"""
+    try:
+        from src.models.user import db, counter_buffer
+        from src.services.metrics import metrics
+        from src.services.popularity import popularity_series
+        from src.services.profiling import request_profiler
+    except ImportError:
+        print("Warning: Database models not found, running without database")
+        return False
     
-    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(database_dir, 'app.db')}"
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', get_database_uri())
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', get_engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
     try:
         db.init_app(app)
+        counter_buffer.init_app(app)
+        popularity_series.init_app(app)
         with app.app_context():
-            db.create_all()
-        print("Database initialized successfully")
+            if db.engine.dialect.name == 'sqlite':
+                event.listen(db.engine, 'connect', apply_sqlite_pragmas)
+            metrics.instrument_engine(db.engine)
+            request_profiler.instrument_engine(db.engine)
     except Exception as e:
         print(f"Database initialization failed: {e}")
+        return False
+    
+    # Deferred to the first request of each worker so importing the app (e.g.
+    # gunicorn --preload) opens no connections that forked workers would share.
+    # Tables are only created with SCHEMA_AUTO_CREATE; the trend index is
+    # always loaded. A failure is retried at most every DB_STARTUP_RETRY seconds.
+    state = {'ready': False, 'retry_at': 0.0}
+    lock = threading.Lock()
+    retry_interval = float(os.environ.get('DB_STARTUP_RETRY', 5))
+    
+    @app.before_request
+    def ensure_database():
+        if state['ready'] or time.monotonic() < state['retry_at']:
+            return
+        with lock:
+            if state['ready'] or time.monotonic() < state['retry_at']:
+                return
+            try:
+                if app.config['SCHEMA_AUTO_CREATE']:
+                    create_schema(app)
+                start_worker(app)
+            except Exception as e:
+                print(f"Database initialization failed: {e}")
+                state['retry_at'] = time.monotonic() + retry_interval
+                return
+            state['ready'] = True
+    
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create database tables and load the trend index"""
+        create_schema(app)
+        start_worker(app)
+    
+    @app.cli.command('migrate-json-columns')
+    def migrate_json_columns_command():
+        """Move legacy JSON list columns into the association tables"""
+        from src.models.user import migrate_json_columns
+        print(f"Migrated {migrate_json_columns()} rows")
+    
+    @app.cli.command('backfill-rollups')
+    def backfill_rollups_command():
+        """Recompute the analytics rollups of past days from the video history"""
+        from src.models.user import CategoryDailyRollup
+        rows, before = CategoryDailyRollup.backfill()
+        print(f"Backfilled {rows} category/day rollups before {before.isoformat()} (later days are left as recorded)")
+    
+    return True
 
-# Health check endpoint
-@app.route('/api/health')
-def health_check():
-    return jsonify({
-        'status': 'healthy',
-        'service': 'ViralCraft AI Backend',
-        'database': 'connected' if DB_AVAILABLE else 'not available',
-        'version': '1.0.0'
-    })
-
-# Serve React app
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    static_folder_path = app.static_folder
+def _register_core_routes(app, db_available):
+    from src.services.metrics import metrics, CONTENT_TYPE
+    from src.services.static_files import StaticManifest
     
-    if static_folder_path is None:
+    # Health check endpoint
+    @app.route('/api/health')
+    def health_check():
         return jsonify({
-            'error': 'Static folder not configured',
-            'message': 'Please build the React app and place files in the static folder'
-        }), 404
-
-    # If path exists, serve it
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    
-    # Otherwise serve index.html (for SPA routing)
-    index_path = os.path.join(static_folder_path, 'index.html')
-    if os.path.exists(index_path):
-        return send_from_directory(static_folder_path, 'index.html')
-    else:
+            'status': 'healthy',
+            'service': 'ViralCraft AI Backend',
+            'database': 'connected' if db_available else 'not available',
+            'version': '1.0.0'
+        })
+    
+    # Prometheus scrape endpoint (all workers when METRICS_DIR is set)
+    @app.route('/api/metrics')
+    def metrics_endpoint():
+        return app.response_class(metrics.render(), mimetype=None, content_type=CONTENT_TYPE)
+    
+    # Built frontend, catalogued once at startup (see StaticManifest)
+    development = os.environ.get('FLASK_ENV') == 'development'
+    static_manifest = StaticManifest(app.static_folder, reload_interval=2 if development else None)
+    app.extensions['static_manifest'] = static_manifest
+    
+    # Serve React app
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        static_folder_path = app.static_folder
+        
+        if static_folder_path is None:
+            return jsonify({
+                'error': 'Static folder not configured',
+                'message': 'Please build the React app and place files in the static folder'
+            }), 404
+        
+        # If path exists, serve it
+        if path != "":
+            response = static_manifest.response(path)
+            if response is not None:
+                return response
+        
+        # Otherwise serve index.html (for SPA routing)
+        response = static_manifest.response('index.html')
+        if response is not None:
+            return response
+        else:
+            return jsonify({
+                'error': 'Frontend not found',
+                'message': 'Please build the React frontend first',
+                'api_status': 'Backend is running on /api/*'
+            }), 404
+    
+    # Error handlers
+    @app.errorhandler(404)
+    def not_found(error):
+        metrics.record_error(404)
         return jsonify({
-            'error': 'Frontend not found',
-            'message': 'Please build the React frontend first',
-            'api_status': 'Backend is running on /api/*'
+            'error': 'Not found',
+            'message': 'The requested resource was not found',
+            'available_endpoints': [
+                '/api/health',
+                '/api/metrics',
+                '/api/generate-video',
+                '/api/trending-elements',
+                '/api/analytics',
+                '/api/register',
+                '/api/login',
+                '/api/profile'
+            ]
         }), 404
+    
+    @app.errorhandler(500)
+    def internal_error(error):
+        metrics.record_error(500)
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'Something went wrong on the server'
+        }), 500
 
-# Error handlers
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({
-        'error': 'Not found',
-        'message': 'The requested resource was not found',
-        'available_endpoints': [
-            '/api/health',
-            '/api/generate-video',
-            '/api/trending-elements',
-            '/api/analytics',
-            '/api/register',
-            '/api/login',
-            '/api/profile'
-        ]
-    }), 404
+def create_app(config=None):
+    """Application factory
+    
+    Building the app has no side effects beyond importing modules: tables are
+    created by `flask --app main init-db` or lazily on the first request
+    (SCHEMA_AUTO_CREATE), and thread pools start on first use, so the app is
+    safe to build once in the gunicorn master with --preload.
+    """
+    timer = _StartupTimer()
+    
+    app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+    
+    # Configuration
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+    app.config['SCHEMA_AUTO_CREATE'] = os.environ.get('SCHEMA_AUTO_CREATE', '1') != '0'
+    # Number of reverse proxies in front of the app whose X-Forwarded-* headers are trusted
+    app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+    if config:
+        app.config.update(config)
+    if app.config['TRUSTED_PROXIES']:
+        # request.remote_addr becomes the client address, so anonymous quotas are per client
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        hops = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+    # Meter anonymous callers per IP only when the address is the client's
+    app.config.setdefault('QUOTA_ANONYMOUS_BY_IP', os.environ.get(
+        'QUOTA_ANONYMOUS_BY_IP', '1' if app.config['TRUSTED_PROXIES'] else '0') == '1')
+    timer.mark('flask')
+    
+    # Enable CORS for all routes
+    from flask_cors import CORS
+    CORS(app, origins=['*'])
+    
+    # Request metrics; registered first so its hooks time the whole request
+    from src.services.metrics import metrics
+    metrics.init_app(app)
+    
+    # Opt-in request profiling (PROFILE_ADMIN_TOKEN, optionally PROFILE_SAMPLE_RATE)
+    from src.services.profiling import request_profiler
+    request_profiler.init_app(app)
+    
+    # Register blueprints
+    user_bp, video_bp = _load_blueprints()
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(video_bp, url_prefix='/api')
+    timer.mark('blueprints')
+    
+    # Database setup (only if available)
+    db_available = _init_database(app)
+    app.config['DB_AVAILABLE'] = db_available
+    timer.mark('database')
+    
+    _register_core_routes(app, db_available)
+    timer.mark('static manifest')
+    
+    app.extensions['startup_report'] = timer
+    if os.environ.get('STARTUP_REPORT') == '1':
+        print(timer.report())
+    
+    return app
 
-@app.errorhandler(500)
-def internal_error(error):
-    return jsonify({
-        'error': 'Internal server error',
-        'message': 'Something went wrong on the server'
-    }), 500
+app = create_app()
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -142,12 +355,13 @@ if __name__ == '__main__':
     print(f"🚀 Starting ViralCraft AI Backend...")
     print(f"📍 Running on: http://0.0.0.0:{port}")
     print(f"🔧 Debug mode: {debug_mode}")
-    print(f"💾 Database: {'Available' if DB_AVAILABLE else 'Not configured'}")
+    print(f"💾 Database: {'Available' if app.config['DB_AVAILABLE'] else 'Not configured'}")
     print(f"📁 Static folder: {app.static_folder}")
+    print(app.extensions['startup_report'].report())
     
     app.run(
         host='0.0.0.0',
         port=port,
         debug=debug_mode,
         use_reloader=debug_mode
-    )
\ No newline at end of file
+    )
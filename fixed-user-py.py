@@ -1,38 +1,244 @@
-from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 import jwt
 import datetime
 from functools import wraps
+from collections import OrderedDict
+import base64
+import csv
+import hashlib
+import hmac
+import io
+import json
 import os
+import threading
+import time
+from sqlalchemy.exc import IntegrityError
+from src.models.user import db, User, VideoHistory, import_history, parse_history_record
+from src.services.metrics import metrics
+from src.services.passwords import HasherBusyError
+from src.services.quotas import quota_store, user_key, ip_key, PLAN_LIMITS, DEFAULT_PLAN, ANONYMOUS_PLAN
 
 user_bp = Blueprint('user', __name__)
 
 # This would typically come from environment variables
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-here')
 
+# Admin endpoints are disabled unless this is set
+ADMIN_TOKEN = os.environ.get('QUOTA_ADMIN_TOKEN')
+
+class TokenCache:
+    """Bounded LRU cache of verified JWT claims, keyed by a digest of the token
+
+    Entries are dropped at the token's exp, so an expired token always goes
+    back through jwt.decode and is rejected there. Revocations are stored in
+    the revoked_tokens table and every worker loads new ones at most every
+    refresh_interval seconds, so a revoked token is rejected everywhere
+    within that time.
+    """
+    
+    def __init__(self, max_size=None, refresh_interval=None):
+        self.max_size = max_size or int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+        self.refresh_interval = float(refresh_interval if refresh_interval is not None
+                                      else os.environ.get('TOKEN_REVOCATION_REFRESH', 1))
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._revoked = {}
+        self._last_revocation_id = 0
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+    
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).digest()
+    
+    def get(self, token):
+        """Cached claims for a token, or None if it has to be verified"""
+        key = self.digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, token, claims):
+        """Remember the claims of a verified token until it expires"""
+        exp = claims.get('exp')
+        if not isinstance(exp, (int, float)):
+            return
+        key = self.digest(token)
+        with self._lock:
+            if key in self._revoked:
+                return
+            self._entries[key] = (claims, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def revoke(self, token):
+        """Reject a token from now on (on every worker), even though its signature is valid"""
+        from src.models.user import RevokedToken
+        
+        key = self.digest(token)
+        try:
+            exp = jwt.decode(token, options={'verify_signature': False}).get('exp')
+        except jwt.InvalidTokenError:
+            exp = None
+        now = time.time()
+        # Revocations are only needed until the token would expire anyway
+        exp = exp if isinstance(exp, (int, float)) else now + 24 * 3600
+        self._forget(key, exp)
+        
+        if current_app.config.get('DB_AVAILABLE'):
+            expires_at = datetime.datetime.utcfromtimestamp(exp)
+            try:
+                RevokedToken.query.filter(RevokedToken.expires_at <= datetime.datetime.utcnow()).delete()
+                if RevokedToken.query.filter_by(digest=key).first() is None:
+                    db.session.add(RevokedToken(digest=key, expires_at=expires_at))
+                db.session.commit()
+            except IntegrityError:
+                # Revoked by another request in the meantime
+                db.session.rollback()
+    
+    def _forget(self, key, exp):
+        now = time.time()
+        with self._lock:
+            self._entries.pop(key, None)
+            for revoked_key in [k for k, e in self._revoked.items() if e <= now]:
+                del self._revoked[revoked_key]
+            self._revoked[key] = exp
+    
+    def is_revoked(self, token):
+        self._maybe_refresh()
+        with self._lock:
+            return self.digest(token) in self._revoked
+    
+    def _maybe_refresh(self):
+        if not current_app.config.get('DB_AVAILABLE'):
+            return
+        if self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        # One request per worker loads the new revocations, the others go on
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            from src.models.user import RevokedToken
+            
+            rows = (db.session.query(RevokedToken.id, RevokedToken.digest, RevokedToken.expires_at)
+                    .filter(RevokedToken.id > self._last_revocation_id,
+                            RevokedToken.expires_at > datetime.datetime.utcnow())
+                    .order_by(RevokedToken.id)
+                    .all())
+            for row_id, key, expires_at in rows:
+                self._forget(key, expires_at.replace(tzinfo=datetime.timezone.utc).timestamp())
+                self._last_revocation_id = row_id
+            self._refreshed_at = time.monotonic()
+        except Exception as e:
+            print(f"Loading revoked tokens failed: {e}")
+        finally:
+            self._refresh_lock.release()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revoked': len(self._revoked)
+            }
+
+token_cache = TokenCache()
+metrics.register_collector('token_cache', token_cache.stats, counters=('hits', 'misses'))
+
+def revoke_token(token):
+    """Revocation hook, e.g. for logout or a compromised session"""
+    token_cache.revoke(token)
+
+def _bearer_token():
+    token = request.headers.get('Authorization')
+    if token and token.startswith('Bearer '):
+        token = token[7:]
+    return token
+
+def verify_token(token):
+    """Claims of a token, from the cache or jwt.decode (raises jwt.InvalidTokenError)"""
+    data = token_cache.get(token)
+    if data is None:
+        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        token_cache.put(token, data)
+    return data
+
 def token_required(f):
     """Decorator to require valid JWT token"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
+        token = _bearer_token()
         
         if not token:
             return jsonify({'error': 'Token is missing'}), 401
         
+        if token_cache.is_revoked(token):
+            return jsonify({'error': 'Token has been revoked'}), 401
+        
         try:
-            if token.startswith('Bearer '):
-                token = token[7:]
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            current_user_id = data['user_id']
+            data = verify_token(token)
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token has expired'}), 401
         except jwt.InvalidTokenError:
             return jsonify({'error': 'Token is invalid'}), 401
         
-        return f(current_user_id, *args, **kwargs)
+        return f(data['user_id'], *args, **kwargs)
     
     return decorated
 
+def optional_token_claims():
+    """Claims of the request's token, or None for anonymous requests and bad tokens"""
+    token = _bearer_token()
+    if not token or token_cache.is_revoked(token):
+        return None
+    try:
+        return verify_token(token)
+    except jwt.InvalidTokenError:
+        return None
+
+def request_quota_subject():
+    """Quota key and plan of the caller, or None if the caller is not metered
+    
+    Signed-in users are metered on the plan stored in the database (not the
+    token's, which is stale after an upgrade). Anonymous callers get the
+    anonymous rate limit per client IP, but only when QUOTA_ANONYMOUS_BY_IP
+    says request.remote_addr is the client (by default when TRUSTED_PROXIES
+    is set); otherwise every visitor behind a proxy would share one bucket.
+    """
+    claims = optional_token_claims()
+    if claims and claims.get('username'):
+        user = User.from_token_subject(claims.get('user_id')) if current_app.config.get('DB_AVAILABLE') else None
+        if user is not None:
+            plan = user.subscription_plan if user.subscription_plan in PLAN_LIMITS else DEFAULT_PLAN
+            return user_key(user.username), plan
+    if current_app.config.get('QUOTA_ANONYMOUS_BY_IP'):
+        return ip_key(request.remote_addr), ANONYMOUS_PLAN
+    return None
+
+def _username_from_subject(subject):
+    return subject[len('user_'):].rsplit('_', 1)[0]
+
+def _hasher_busy():
+    response = jsonify({
+        'error': 'Server busy',
+        'message': 'Too many sign-ins in progress, please retry shortly'
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @user_bp.route('/register', methods=['POST'])
 def register():
     """Register a new user"""
@@ -56,16 +262,19 @@ def register():
         if not password or len(password) < 6:
             return jsonify({'error': 'Password must be at least 6 characters long'}), 400
         
-        # In a real app, you'd check if user exists in database
-        # For now, we'll simulate a successful registration
+        if User.query.filter((User.username == username) | (User.email == email)).first():
+            return jsonify({'error': 'Username or email is already registered'}), 409
         
-        # Hash the password
-        password_hash = generate_password_hash(password)
+        # Hash the password (limited by the password hashing pool)
+        user = User(username, email, password)
+        db.session.add(user)
+        db.session.commit()
         
         # Create JWT token
         token = jwt.encode({
             'user_id': f"user_{username}_{datetime.datetime.utcnow().timestamp()}",
             'username': username,
+            'plan': user.subscription_plan,
             'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
         }, SECRET_KEY, algorithm='HS256')
         
@@ -80,6 +289,8 @@ def register():
             'token': token
         }), 201
         
+    except HasherBusyError:
+        return _hasher_busy()
     except Exception as e:
         return jsonify({
             'error': 'Registration failed',
@@ -101,16 +312,21 @@ def login():
         if not username or not password:
             return jsonify({'error': 'Username and password are required'}), 400
         
-        # In a real app, you'd verify credentials against database
-        # For demo purposes, we'll accept any non-empty credentials
-        
         if len(username) < 3:
             return jsonify({'error': 'Invalid credentials'}), 401
         
+        user = User.query.filter_by(username=username).first()
+        # Rehashes transparently when the stored cost parameters are outdated
+        if user is None or not user.check_and_upgrade_password(password):
+            return jsonify({'error': 'Invalid credentials'}), 401
+        user.last_login = datetime.datetime.utcnow()
+        db.session.commit()
+        
         # Create JWT token
         token = jwt.encode({
             'user_id': f"user_{username}_{datetime.datetime.utcnow().timestamp()}",
             'username': username,
+            'plan': user.subscription_plan,
             'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
         }, SECRET_KEY, algorithm='HS256')
         
@@ -124,12 +340,24 @@ def login():
             'token': token
         })
         
+    except HasherBusyError:
+        return _hasher_busy()
     except Exception as e:
         return jsonify({
             'error': 'Login failed',
             'message': str(e)
         }), 500
 
+@user_bp.route('/logout', methods=['POST'])
+@token_required
+def logout(current_user_id):
+    """Logout user by revoking the current token"""
+    revoke_token(_bearer_token())
+    return jsonify({
+        'success': True,
+        'message': 'Logged out successfully'
+    })
+
 @user_bp.route('/profile', methods=['GET'])
 @token_required
 def get_profile(current_user_id):
@@ -188,40 +416,55 @@ def update_profile(current_user_id):
             'message': str(e)
         }), 500
 
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+def encode_cursor(row):
+    """Opaque cursor pointing after a history row"""
+    raw = json.dumps([row.created_at.isoformat(), row.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, raises ValueError on a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
 @user_bp.route('/history', methods=['GET'])
 @token_required
 def get_video_history(current_user_id):
-    """Get user's video generation history"""
+    """Get user's video generation history, newest first, one page at a time"""
     try:
-        # Mock history data
-        history = [
-            {
-                'id': 1,
-                'prompt': 'A funny reaction to trying a new food trend',
-                'viral_score': 87,
-                'created_at': '2024-01-15T10:30:00Z',
-                'applied_trends': ['Trending Audio Clip', 'POV Format']
-            },
-            {
-                'id': 2,
-                'prompt': 'Dance challenge with my pet dog',
-                'viral_score': 92,
-                'created_at': '2024-01-14T15:45:00Z',
-                'applied_trends': ['Viral Dance Beat #1', 'Neon Glow Transition']
-            },
-            {
-                'id': 3,
-                'prompt': 'Tutorial on organizing your room in 60 seconds',
-                'viral_score': 78,
-                'created_at': '2024-01-13T09:20:00Z',
-                'applied_trends': ['Before/After', 'Color Pop Filter']
-            }
-        ]
+        try:
+            limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        
+        cursor = request.args.get('cursor')
+        try:
+            before = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        category = request.args.get('category')
+        
+        user = User.from_token_subject(current_user_id)
+        if user is None:
+            rows, has_more = [], False
+        else:
+            rows, has_more = VideoHistory.page_for_user(user.id, limit=limit, before=before, category=category)
+        
+        history = [row.to_dict() for row in rows]
         
         return jsonify({
             'success': True,
             'history': history,
-            'total': len(history)
+            'total': len(history),
+            'hasMore': has_more,
+            'nextCursor': encode_cursor(rows[-1]) if has_more else None
         })
         
     except Exception as e:
@@ -230,6 +473,149 @@ def get_video_history(current_user_id):
             'message': str(e)
         }), 500
 
+HISTORY_EXPORT_BATCH_SIZE = int(os.environ.get('HISTORY_EXPORT_BATCH_SIZE', 500))
+HISTORY_IMPORT_CHUNK_SIZE = int(os.environ.get('HISTORY_IMPORT_CHUNK_SIZE', 500))
+HISTORY_IMPORT_MAX_ROWS = int(os.environ.get('HISTORY_IMPORT_MAX_ROWS', 100000))
+HISTORY_IMPORT_MAX_ERRORS = 100
+
+HISTORY_CSV_COLUMNS = ['id', 'prompt', 'description', 'applied_trends', 'viral_score', 'content_category',
+                       'suggested_platforms', 'created_at', 'is_favorite']
+# Separates the names of a list column in CSV
+HISTORY_CSV_LIST_SEPARATOR = '|'
+
+def _history_format(content_type=None):
+    """'ndjson' or 'csv' from ?format=, falling back to the content type"""
+    requested = request.args.get('format')
+    if requested:
+        return requested.lower()
+    return 'csv' if content_type and content_type.startswith('text/csv') else 'ndjson'
+
+def _iter_ndjson(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+def _iter_csv(records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    def written():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+    
+    writer.writerow(HISTORY_CSV_COLUMNS)
+    yield written()
+    for record in records:
+        row = dict(record)
+        for column in ('applied_trends', 'suggested_platforms'):
+            row[column] = HISTORY_CSV_LIST_SEPARATOR.join(row[column])
+        writer.writerow([row[column] for column in HISTORY_CSV_COLUMNS])
+        yield written()
+
+def _read_ndjson(stream):
+    """(line number, record) per non-empty line; records that are not valid JSON come back as ValueError"""
+    for number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8'), 1):
+        if line.strip():
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, ValueError('invalid JSON')
+
+def _read_csv(stream):
+    """(line number, record) per CSV row, with the columns of the export"""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+    for row in reader:
+        record = {key: value if value != '' else None for key, value in row.items() if key}
+        for column in ('applied_trends', 'suggested_platforms'):
+            if record.get(column) is not None:
+                record[column] = record[column].split(HISTORY_CSV_LIST_SEPARATOR)
+        if record.get('is_favorite') is not None:
+            record['is_favorite'] = record['is_favorite'].lower() in ('true', '1', 'yes')
+        yield reader.line_num, record
+
+@user_bp.route('/history/export', methods=['GET'])
+@token_required
+def export_video_history(current_user_id):
+    """Stream the user's whole history, oldest first, as NDJSON (default) or CSV"""
+    try:
+        export_format = _history_format()
+        if export_format not in ('ndjson', 'csv'):
+            return jsonify({'error': 'format must be ndjson or csv'}), 400
+        
+        user = User.from_token_subject(current_user_id)
+        records = VideoHistory.iter_export(user.id, batch_size=HISTORY_EXPORT_BATCH_SIZE) if user is not None else iter(())
+        
+        if export_format == 'csv':
+            body, mimetype = _iter_csv(records), 'text/csv'
+        else:
+            body, mimetype = _iter_ndjson(records), 'application/x-ndjson'
+        
+        # Rows are written as they are read, so the export never sits in memory
+        response = Response(stream_with_context(body), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=viralcraft-history.{export_format}'
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+        
+    except Exception as e:
+        return jsonify({
+            'error': 'Failed to export history',
+            'message': str(e)
+        }), 500
+
+@user_bp.route('/history/import', methods=['POST'])
+@token_required
+def import_video_history(current_user_id):
+    """Bulk load history records (as exported) from an NDJSON or CSV request body"""
+    try:
+        import_format = _history_format(request.content_type)
+        if import_format not in ('ndjson', 'csv'):
+            return jsonify({'error': 'format must be ndjson or csv'}), 400
+        
+        user = User.from_token_subject(current_user_id)
+        if user is None:
+            return jsonify({'error': 'User not found'}), 404
+        
+        errors = []
+        counts = {'rejected': 0, 'truncated': False}
+        
+        def valid_records():
+            lines = _read_csv(request.stream) if import_format == 'csv' else _read_ndjson(request.stream)
+            accepted = 0
+            for line, record in lines:
+                try:
+                    if isinstance(record, ValueError):
+                        raise record
+                    parsed = parse_history_record(record)
+                except ValueError as e:
+                    counts['rejected'] += 1
+                    if len(errors) < HISTORY_IMPORT_MAX_ERRORS:
+                        errors.append({'line': line, 'error': str(e)})
+                    continue
+                if accepted >= HISTORY_IMPORT_MAX_ROWS:
+                    counts['truncated'] = True
+                    return
+                accepted += 1
+                yield parsed
+        
+        # Records are parsed and inserted a chunk at a time as the body is read
+        imported = import_history(user, valid_records(), chunk_size=HISTORY_IMPORT_CHUNK_SIZE)
+        
+        return jsonify({
+            'success': True,
+            'imported': imported,
+            'rejected': counts['rejected'],
+            'truncated': counts['truncated'],
+            'errors': errors
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'error': 'Failed to import history',
+            'message': str(e)
+        }), 500
+
 @user_bp.route('/favorites', methods=['POST'])
 @token_required
 def add_favorite(current_user_id):
@@ -257,18 +643,22 @@ def add_favorite(current_user_id):
 def get_subscription_info(current_user_id):
     """Get user subscription information"""
     try:
+        user = User.from_token_subject(current_user_id)
+        plan = user.subscription_plan if user is not None and user.subscription_plan in PLAN_LIMITS else DEFAULT_PLAN
+        quota = quota_store.status(user_key(_username_from_subject(current_user_id)), plan)
+        
         subscription_info = {
-            'plan': 'free',
-            'videos_remaining': 3,
-            'videos_total': 5,
-            'reset_date': '2024-02-01T00:00:00Z',
+            'plan': plan,
+            'videos_remaining': quota.remaining,
+            'videos_total': quota.limit,
+            'reset_date': quota.reset_at,
             'features': {
-                'hd_export': False,
-                'unlimited_videos': False,
-                'premium_trends': False,
-                'analytics': False
+                'hd_export': plan != 'free',
+                'unlimited_videos': quota.limit is None,
+                'premium_trends': plan != 'free',
+                'analytics': plan == 'business'
             },
-            'upgrade_options': [
+            'upgrade_options': [option for option in [
                 {
                     'plan': 'pro',
                     'price': '$19.99/month',
@@ -279,7 +669,7 @@ def get_subscription_info(current_user_id):
                     'price': '$49.99/month',
                     'features': ['All Pro features', 'Team collaboration', 'Analytics dashboard']
                 }
-            ]
+            ] if option['plan'] != plan]
         }
         
         return jsonify({
@@ -291,4 +681,35 @@ def get_subscription_info(current_user_id):
         return jsonify({
             'error': 'Failed to fetch subscription info',
             'message': str(e)
+        }), 500
+
+@user_bp.route('/admin/quotas/reset', methods=['POST'])
+def reset_quotas():
+    """Reset the generation quota of a user, an IP address, or everyone"""
+    if not ADMIN_TOKEN or not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        if data.get('all'):
+            quota_store.reset()
+            return jsonify({'success': True, 'message': 'All quotas reset'})
+        
+        if data.get('username'):
+            key = user_key(data['username'])
+        elif data.get('ip'):
+            key = ip_key(data['ip'])
+        else:
+            return jsonify({'error': 'username, ip or all is required'}), 400
+        
+        return jsonify({
+            'success': True,
+            'reset': quota_store.reset(key)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'error': 'Failed to reset quotas',
+            'message': str(e)
         }), 500
\ No newline at end of file
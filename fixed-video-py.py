@@ -1,7 +1,20 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify
+import hashlib
+import json
+import os
 import random
+import re
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
+from types import MappingProxyType
+from src.services.cache import ResultCache, SnapshotCache
+from src.services.classifier import content_classifier
+from src.services.jobs import job_queue, QueueFullError
+from src.services.metrics import metrics
+from src.services.popularity import popularity_series
+from src.services.quotas import quota_store
+from src.services.scoring import MAX_SCORE, viral_score_model
+from src.services.trends import trend_index
 
 video_bp = Blueprint('video', __name__)
 
@@ -38,112 +51,399 @@ TRENDING_MEMES = [
 
 def get_content_category(prompt):
     """Analyze prompt to determine content category"""
-    prompt_lower = prompt.lower()
-    
-    if any(word in prompt_lower for word in ['dance', 'dancing', 'choreography', 'moves']):
-        return 'dance'
-    elif any(word in prompt_lower for word in ['food', 'cooking', 'recipe', 'eating', 'taste']):
-        return 'food'
-    elif any(word in prompt_lower for word in ['tutorial', 'how to', 'learn', 'teach', 'guide']):
-        return 'tutorial'
-    elif any(word in prompt_lower for word in ['pet', 'dog', 'cat', 'animal']):
-        return 'pet'
-    elif any(word in prompt_lower for word in ['reaction', 'react', 'respond', 'review']):
-        return 'reaction'
-    elif any(word in prompt_lower for word in ['makeup', 'beauty', 'skincare', 'outfit']):
-        return 'beauty'
-    elif any(word in prompt_lower for word in ['room', 'home', 'decor', 'organize']):
-        return 'lifestyle'
-    elif any(word in prompt_lower for word in ['funny', 'comedy', 'joke', 'humor']):
-        return 'comedy'
-    else:
-        return 'general'
+    return content_classifier.classify(prompt)
+
+# Category-specific suggestions
+CATEGORY_SUGGESTIONS = MappingProxyType({
+    'dance': (
+        "• Sync movements with beat drops and audio cues",
+        "• Use quick cuts between different angles",
+        "• Add mirror or split-screen effects for comparison",
+        "• Include slow-motion highlights of key moves",
+        "• Use trending dance hashtags and challenges"
+    ),
+    'food': (
+        "• Capture close-up shots with satisfying sound effects",
+        "• Add text overlay with ratings or taste reactions",
+        "• Use trending food styling and presentation techniques",
+        "• Include before/during/after shots",
+        "• Add popular food-related audio clips"
+    ),
+    'tutorial': (
+        "• Break down into clear step-by-step segments",
+        "• Use text overlays for each step",
+        "• Include before/after comparison shots",
+        "• Add time-lapse for longer processes",
+        "• Use educational trending formats"
+    ),
+    'pet': (
+        "• Capture cute pet reaction shots",
+        "• Use trending pet sounds and effects",
+        "• Include popular pet challenge formats",
+        "• Add funny captions and text overlays",
+        "• Use pet-specific viral audio clips"
+    ),
+    'reaction': (
+        "• Use split-screen reaction format",
+        "• Add trending reaction sounds and effects",
+        "• Include emotional text overlays",
+        "• Capture genuine expressions and responses",
+        "• Use popular reaction challenge formats"
+    ),
+    'beauty': (
+        "• Use good lighting and close-up shots",
+        "• Add before/after transformation reveals",
+        "• Include trending beauty audio and effects",
+        "• Use popular makeup/skincare formats",
+        "• Add product recommendations and links"
+    ),
+    'lifestyle': (
+        "• Show transformation process with time-lapse",
+        "• Use aesthetic trending effects and filters",
+        "• Add satisfying organization moments",
+        "• Include trending lifestyle audio",
+        "• Use popular home/lifestyle formats"
+    ),
+    'comedy': (
+        "• Perfect timing with comedic beats",
+        "• Use trending comedy audio and sound effects",
+        "• Add funny text overlays and captions",
+        "• Include popular comedy formats and structures",
+        "• Use relatable humor and situations"
+    ),
+    'general': (
+        "• Apply trending visual effects for engagement",
+        "• Include popular audio elements",
+        "• Use current meme formats and structures",
+        "• Add dynamic transitions and cuts",
+        "• Include trending hashtags and challenges"
+    )
+})
+
+# Description sections that never change, rendered once at import
+SUGGESTION_BLOCKS = MappingProxyType({
+    category: ''.join(suggestion + "\n" for suggestion in suggestions[:4])  # Limit to 4 suggestions
+    for category, suggestions in CATEGORY_SUGGESTIONS.items()
+})
+
+PLATFORM_TIPS = (
+    "\n🎯 Platform Optimization Tips:\n"
+    "• TikTok: Hook viewers in first 3 seconds\n"
+    "• Instagram Reels: Use trending audio and hashtags\n"
+    "• YouTube Shorts: Strong thumbnail and title\n"
+)
+
+def iter_description_sections(prompt, content_category, applied_trends):
+    """Yield the description section by section, e.g. for streaming"""
+    yield f"🎬 Enhanced version of your idea: \"{prompt}\"\n\n🚀 AI Suggestions:\n"
+    yield SUGGESTION_BLOCKS.get(content_category, SUGGESTION_BLOCKS['general'])
+    yield f"\n✨ Trending elements applied: {', '.join([t['name'] for t in applied_trends])}\n"
+    yield PLATFORM_TIPS
 
 def generate_enhanced_description(prompt, content_category, applied_trends):
     """Generate detailed AI suggestions based on content type"""
+    return ''.join(iter_description_sections(prompt, content_category, applied_trends))
+
+# Only elements above this popularity are applied to generated videos
+TREND_MIN_POPULARITY = 80
+
+# Built-in catalog; TrendingElement rows are merged over it (see sync_with_database)
+trend_index.load(TRENDING_SOUNDS, 'sound')
+trend_index.load(TRENDING_EFFECTS, 'effect')
+trend_index.load(TRENDING_MEMES, 'meme')
+
+# Best platforms based on content category
+PLATFORM_MAPPING = {
+    'dance': ['TikTok', 'Instagram Reels', 'YouTube Shorts'],
+    'food': ['TikTok', 'Instagram Reels', 'Pinterest'],
+    'tutorial': ['YouTube Shorts', 'TikTok', 'Instagram Reels'],
+    'pet': ['TikTok', 'Instagram Reels', 'YouTube Shorts'],
+    'beauty': ['Instagram Reels', 'TikTok', 'YouTube Shorts'],
+    'lifestyle': ['Instagram Reels', 'Pinterest', 'TikTok'],
+    'comedy': ['TikTok', 'Instagram Reels', 'YouTube Shorts'],
+    'general': ['TikTok', 'Instagram Reels', 'YouTube Shorts']
+}
+
+DEFAULT_PLATFORMS = ['TikTok', 'Instagram Reels', 'YouTube Shorts']
+
+BATCH_MAX_PROMPTS = int(os.environ.get('BATCH_MAX_PROMPTS', 500))
+
+# Set SIMULATE_PROCESSING=0 to skip the artificial delay (e.g. when benchmarking)
+SIMULATE_PROCESSING = os.environ.get('SIMULATE_PROCESSING', '1') != '0'
+
+def simulate_processing():
+    """Simulate AI processing time (2-4 seconds)"""
+    if not SIMULATE_PROCESSING:
+        return 0.0
+    processing_time = 2 + random.random() * 2
+    time.sleep(processing_time)
+    return processing_time
+
+def select_trends(rng=random):
+    """Randomly select 1-3 trending elements to apply, favouring the most popular"""
+    applied_trends = []
     
-    base_description = f"🎬 Enhanced version of your idea: \"{prompt}\"\n\n🚀 AI Suggestions:\n"
-    
-    # Category-specific suggestions
-    category_suggestions = {
-        'dance': [
-            "• Sync movements with beat drops and audio cues",
-            "• Use quick cuts between different angles",
-            "• Add mirror or split-screen effects for comparison",
-            "• Include slow-motion highlights of key moves",
-            "• Use trending dance hashtags and challenges"
-        ],
-        'food': [
-            "• Capture close-up shots with satisfying sound effects",
-            "• Add text overlay with ratings or taste reactions",
-            "• Use trending food styling and presentation techniques",
-            "• Include before/during/after shots",
-            "• Add popular food-related audio clips"
-        ],
-        'tutorial': [
-            "• Break down into clear step-by-step segments",
-            "• Use text overlays for each step",
-            "• Include before/after comparison shots",
-            "• Add time-lapse for longer processes",
-            "• Use educational trending formats"
-        ],
-        'pet': [
-            "• Capture cute pet reaction shots",
-            "• Use trending pet sounds and effects",
-            "• Include popular pet challenge formats",
-            "• Add funny captions and text overlays",
-            "• Use pet-specific viral audio clips"
-        ],
-        'reaction': [
-            "• Use split-screen reaction format",
-            "• Add trending reaction sounds and effects",
-            "• Include emotional text overlays",
-            "• Capture genuine expressions and responses",
-            "• Use popular reaction challenge formats"
-        ],
-        'beauty': [
-            "• Use good lighting and close-up shots",
-            "• Add before/after transformation reveals",
-            "• Include trending beauty audio and effects",
-            "• Use popular makeup/skincare formats",
-            "• Add product recommendations and links"
-        ],
-        'lifestyle': [
-            "• Show transformation process with time-lapse",
-            "• Use aesthetic trending effects and filters",
-            "• Add satisfying organization moments",
-            "• Include trending lifestyle audio",
-            "• Use popular home/lifestyle formats"
-        ],
-        'comedy': [
-            "• Perfect timing with comedic beats",
-            "• Use trending comedy audio and sound effects",
-            "• Add funny text overlays and captions",
-            "• Include popular comedy formats and structures",
-            "• Use relatable humor and situations"
-        ],
-        'general': [
-            "• Apply trending visual effects for engagement",
-            "• Include popular audio elements",
-            "• Use current meme formats and structures",
-            "• Add dynamic transitions and cuts",
-            "• Include trending hashtags and challenges"
-        ]
+    for element_type, chance in (('sound', 0.2), ('effect', 0.3), ('meme', 0.4)):
+        # 80% / 70% / 60% chance
+        if rng.random() > chance:
+            trend = trend_index.sample(element_type, TREND_MIN_POPULARITY, rng=rng)
+            if trend is not None:
+                applied_trends.append(trend)
+    
+    return applied_trends
+
+def finish_viral_score(model_score, rng=random):
+    """Add the random 0-10 bonus to a model score and cap it"""
+    return max(0, min(MAX_SCORE, int(round(model_score)) + rng.randint(0, 10)))
+
+def calculate_viral_score(prompt, content_category, applied_trends, rng=random):
+    """Calculate viral score based on various factors (see ViralScoreModel)"""
+    return finish_viral_score(viral_score_model.score(prompt, content_category, applied_trends), rng)
+
+def assemble_video_concept(prompt, content_category, processing_time, applied_trends=None, viral_score=None,
+                           rng=random):
+    """Build the response for an already classified prompt"""
+    if applied_trends is None:
+        applied_trends = select_trends(rng)
+    description = generate_enhanced_description(prompt, content_category, applied_trends)
+    if viral_score is None:
+        viral_score = calculate_viral_score(prompt, content_category, applied_trends, rng)
+    
+    return {
+        'success': True,
+        'description': description,
+        'appliedTrends': [trend['name'] for trend in applied_trends],
+        'estimatedViralScore': viral_score,
+        'suggestedPlatforms': PLATFORM_MAPPING.get(content_category, DEFAULT_PLATFORMS),
+        'contentCategory': content_category,
+        'processingTime': round(processing_time, 2),
+        'generatedAt': int(time.time()),
+        'recommendations': {
+            'bestPostingTime': '6-9 PM or 12-3 PM',
+            'suggestedHashtags': f"#{content_category}video #viral #trending #fyp",
+            'estimatedReach': f"{rng.randint(10, 100)}K - {rng.randint(500, 2000)}K views"
+        }
+    }
+
+# Generated concepts by normalized prompt; a repeated prompt skips the
+# whole pipeline (including the processing delay)
+generation_cache = ResultCache(int(os.environ.get('GENERATION_CACHE_SIZE', 10000)),
+                               int(os.environ.get('GENERATION_CACHE_TTL', 3600)))
+metrics.register_collector('generation_cache', lambda: {
+    name: value for name, value in generation_cache.stats().items() if name != 'hit_rate'
+}, counters=('hits', 'misses', 'evictions', 'expirations'))
+
+_PROMPT_SEPARATORS_RE = re.compile(r'[\W_]+')
+
+def normalize_prompt(prompt):
+    """Prompt with case, whitespace and punctuation folded, e.g. 'Dance  party!' -> 'dance party'"""
+    return _PROMPT_SEPARATORS_RE.sub(' ', prompt.lower()).strip()
+
+def prompt_rng(normalized_prompt):
+    """Random generator seeded by the prompt, so the same prompt always gets the same trends and score"""
+    seed = int.from_bytes(hashlib.sha256(normalized_prompt.encode('utf-8')).digest()[:8], 'big')
+    return random.Random(seed)
+
+def cached_video_concept(prompt, normalized_prompt):
+    """Cached concept for an equivalent prompt, with the description quoting this prompt
+    
+    generatedAt is the time of this response and processingTime 0, since a
+    hit skips processing.
+    """
+    cached = generation_cache.get(normalized_prompt)
+    if cached is None:
+        return None
+    cached_prompt, concept = cached
+    concept = dict(concept, cached=True, processingTime=0.0, generatedAt=int(time.time()))
+    if prompt != cached_prompt:
+        applied_trends = [{'name': name} for name in concept['appliedTrends']]
+        concept['description'] = generate_enhanced_description(prompt, concept['contentCategory'], applied_trends)
+    return concept
+
+def build_video_concept(prompt):
+    """Run the full generation pipeline for a prompt and build the response"""
+    normalized_prompt = normalize_prompt(prompt)
+    concept = cached_video_concept(prompt, normalized_prompt)
+    if concept is not None:
+        return concept
+    
+    processing_time = simulate_processing()
+    concept = assemble_video_concept(prompt, get_content_category(prompt), processing_time,
+                                     rng=prompt_rng(normalized_prompt))
+    generation_cache.put(normalized_prompt, (prompt, concept))
+    return dict(concept)
+
+def _concept_events(prompt, concept):
+    content_category = concept['contentCategory']
+    yield 'category', {'contentCategory': content_category, 'suggestedPlatforms': concept['suggestedPlatforms']}
+    yield 'trends', {'appliedTrends': concept['appliedTrends']}
+    yield 'score', {'estimatedViralScore': concept['estimatedViralScore']}
+    applied_trends = [{'name': name} for name in concept['appliedTrends']]
+    for index, section in enumerate(iter_description_sections(prompt, content_category, applied_trends)):
+        yield 'description', {'index': index, 'text': section}
+    yield 'done', concept
+
+def iter_video_concept_events(prompt):
+    """Run the generation pipeline for a prompt, yielding (event, data) as each stage completes"""
+    normalized_prompt = normalize_prompt(prompt)
+    concept = cached_video_concept(prompt, normalized_prompt)
+    if concept is not None:
+        yield from _concept_events(prompt, concept)
+        return
+    
+    rng = prompt_rng(normalized_prompt)
+    content_category = get_content_category(prompt)
+    yield 'category', {
+        'contentCategory': content_category,
+        'suggestedPlatforms': PLATFORM_MAPPING.get(content_category, DEFAULT_PLATFORMS)
     }
     
-    suggestions = category_suggestions.get(content_category, category_suggestions['general'])
-    for suggestion in suggestions[:4]:  # Limit to 4 suggestions
-        base_description += suggestion + "\n"
+    processing_time = simulate_processing()
+    applied_trends = select_trends(rng)
+    yield 'trends', {'appliedTrends': [trend['name'] for trend in applied_trends]}
+    
+    viral_score = calculate_viral_score(prompt, content_category, applied_trends, rng)
+    yield 'score', {'estimatedViralScore': viral_score}
+    
+    for index, section in enumerate(iter_description_sections(prompt, content_category, applied_trends)):
+        yield 'description', {'index': index, 'text': section}
+    
+    # The complete payload, identical in shape to the non-streaming response
+    concept = assemble_video_concept(prompt, content_category, processing_time,
+                                     applied_trends=applied_trends, viral_score=viral_score, rng=rng)
+    generation_cache.put(normalized_prompt, (prompt, concept))
+    yield 'done', dict(concept)
+
+def build_video_concepts(prompts):
+    """Run the generation pipeline once for a whole batch of prompts"""
+    results = [None] * len(prompts)
+    misses = []
+    for i, prompt in enumerate(prompts):
+        if isinstance(prompt, str) and prompt.strip():
+            normalized_prompt = normalize_prompt(prompt)
+            concept = cached_video_concept(prompt, normalized_prompt)
+            if concept is not None:
+                results[i] = dict(concept, index=i)
+            else:
+                misses.append((i, prompt, normalized_prompt))
+    
+    # Only prompts that were not cached pay for processing
+    processing_time = simulate_processing() if misses else 0.0
+    categories = content_classifier.classify_many([prompt for _, prompt, _ in misses])
     
-    base_description += f"\n✨ Trending elements applied: {', '.join([t['name'] for t in applied_trends])}\n"
+    # Trends drawn per prompt, then the whole batch scored in one matrix product
+    rngs = [prompt_rng(normalized_prompt) for _, _, normalized_prompt in misses]
+    trend_lists = [select_trends(rng) for rng in rngs]
+    model_scores = viral_score_model.score_many([prompt for _, prompt, _ in misses], categories, trend_lists)
     
-    # Add platform-specific tips
-    base_description += "\n🎯 Platform Optimization Tips:\n"
-    base_description += "• TikTok: Hook viewers in first 3 seconds\n"
-    base_description += "• Instagram Reels: Use trending audio and hashtags\n"
-    base_description += "• YouTube Shorts: Strong thumbnail and title\n"
+    for (i, prompt, normalized_prompt), content_category, rng, applied_trends, model_score in zip(
+            misses, categories, rngs, trend_lists, model_scores):
+        try:
+            result = assemble_video_concept(prompt, content_category, processing_time,
+                                            applied_trends=applied_trends,
+                                            viral_score=finish_viral_score(model_score, rng), rng=rng)
+            generation_cache.put(normalized_prompt, (prompt, result))
+            result = dict(result, index=i)
+        except Exception as e:
+            result = {'success': False, 'error': str(e), 'index': i}
+        results[i] = result
     
-    return base_description
+    for i, result in enumerate(results):
+        if result is None:
+            results[i] = {'index': i, 'success': False, 'error': 'Prompt is required'}
+    
+    return {
+        'success': True,
+        'results': results,
+        'total': len(results),
+        'failed': sum(1 for r in results if not r['success']),
+        'processingTime': round(processing_time, 2)
+    }
+
+def _wants_async(data):
+    return bool(data.get('async')) or request.args.get('mode') == 'async'
+
+def _check_quota(count=1):
+    """429 response if the caller is over its plan's quota or rate limit, else None"""
+    # Imported here so the video routes load without the user routes
+    from src.routes.user import request_quota_subject
+    
+    subject = request_quota_subject()
+    if subject is None:
+        return None
+    key, plan = subject
+    decision = quota_store.consume(key, plan, count)
+    if decision.allowed:
+        return None
+    
+    if decision.reason == 'monthly':
+        message = f"The {plan} plan includes {decision.limit} videos per month"
+    else:
+        message = 'Too many requests, please slow down'
+    response = jsonify({
+        'error': 'Quota exceeded' if decision.reason == 'monthly' else 'Rate limit exceeded',
+        'message': message,
+        'plan': plan,
+        'videosRemaining': decision.remaining,
+        'resetDate': decision.reset_at
+    })
+    response.headers['Retry-After'] = str(decision.retry_after)
+    return response, 429
+
+def _generation_recorder():
+    """Callable that stores (prompt, concept) pairs in the caller's history, or None if anonymous"""
+    if not current_app.config.get('DB_AVAILABLE'):
+        return None
+    from src.routes.user import optional_token_claims
+    
+    claims = optional_token_claims()
+    if not claims:
+        return None
+    subject = claims.get('user_id')
+    app = current_app._get_current_object()
+    
+    def record(generations):
+        # Also called from job workers and streaming responses, outside the request
+        try:
+            with app.app_context():
+                from src.models.user import User, record_generations
+                user = User.from_token_subject(subject)
+                if user is not None:
+                    record_generations(user, generations)
+        except Exception as e:
+            print(f"Recording generation history failed: {e}")
+    
+    return record
+
+def generate_and_record(record, prompt):
+    concept = build_video_concept(prompt)
+    if record:
+        record([(prompt, concept)])
+    return concept
+
+def generate_batch_and_record(record, prompts):
+    result = build_video_concepts(prompts)
+    if record:
+        record([(prompts[r['index']], r) for r in result['results']])
+    return result
+
+def _submit_job(func, *args):
+    """Queue a generation job and build the 202 response"""
+    try:
+        job_id = job_queue.submit(func, *args)
+    except QueueFullError as e:
+        return jsonify({
+            'error': 'Server busy',
+            'message': str(e)
+        }), 503
+    
+    return jsonify({
+        'success': True,
+        'jobId': job_id,
+        'status': 'queued',
+        'statusUrl': f"/api/jobs/{job_id}",
+        'resultUrl': f"/api/jobs/{job_id}/result"
+    }), 202
 
 @video_bp.route('/generate-video', methods=['POST'])
 def generate_video():
@@ -154,74 +454,90 @@ def generate_video():
         if not prompt:
             return jsonify({'error': 'Prompt is required'}), 400
         
-        # Simulate AI processing time (2-4 seconds)
-        processing_time = 2 + random.random() * 2
-        time.sleep(processing_time)
+        over_quota = _check_quota()
+        if over_quota:
+            return over_quota
+        
+        record = _generation_recorder()
+        
+        # Submit/poll mode: hand the generation to the background workers
+        if _wants_async(data):
+            return _submit_job(generate_and_record, record, prompt)
+        
+        return jsonify(generate_and_record(record, prompt))
         
-        # Determine content category
-        content_category = get_content_category(prompt)
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+@video_bp.route('/generate-video/stream', methods=['GET', 'POST'])
+def generate_video_stream():
+    """Generate a video concept as Server-Sent Events, one event per pipeline stage"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            prompt = data.get('prompt', '')
+        else:
+            prompt = request.args.get('prompt', '')
         
-        # Select trending elements to apply based on content category
-        applied_trends = []
+        if not prompt:
+            return jsonify({'error': 'Prompt is required'}), 400
         
-        # Smart selection based on content type
-        relevant_sounds = [s for s in TRENDING_SOUNDS if s['popularity'] > 80]
-        relevant_effects = [e for e in TRENDING_EFFECTS if e['popularity'] > 80]
-        relevant_memes = [m for m in TRENDING_MEMES if m['popularity'] > 80]
+        over_quota = _check_quota()
+        if over_quota:
+            return over_quota
         
-        # Randomly select 1-3 elements
-        if random.random() > 0.2:  # 80% chance
-            applied_trends.append(random.choice(relevant_sounds))
-        if random.random() > 0.3:  # 70% chance
-            applied_trends.append(random.choice(relevant_effects))
-        if random.random() > 0.4:  # 60% chance
-            applied_trends.append(random.choice(relevant_memes))
+        record = _generation_recorder()
         
-        # Generate enhanced description
-        enhanced_description = generate_enhanced_description(prompt, content_category, applied_trends)
+        def stream():
+            try:
+                for event, data in iter_video_concept_events(prompt):
+                    yield _sse_event(event, data)
+                    if event == 'done' and record:
+                        record([(prompt, data)])
+            except Exception as e:
+                yield _sse_event('error', {'error': 'Internal server error', 'message': str(e)})
         
-        # Calculate viral score based on various factors
-        base_score = 70
-        if len(prompt) > 50:  # Detailed prompts get higher scores
-            base_score += 10
-        if content_category in ['dance', 'food', 'pet']:  # Popular categories
-            base_score += 5
-        if len(applied_trends) >= 2:  # Multiple trends applied
-            base_score += 8
+        response = Response(stream(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the events
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
         
-        viral_score = min(95, base_score + random.randint(0, 10))
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+@video_bp.route('/generate-video/batch', methods=['POST'])
+def generate_video_batch():
+    """Generate video concepts for many prompts in one request"""
+    try:
+        data = request.get_json()
+        prompts = data.get('prompts') if data else None
         
-        # Determine best platforms based on content category
-        platform_mapping = {
-            'dance': ['TikTok', 'Instagram Reels', 'YouTube Shorts'],
-            'food': ['TikTok', 'Instagram Reels', 'Pinterest'],
-            'tutorial': ['YouTube Shorts', 'TikTok', 'Instagram Reels'],
-            'pet': ['TikTok', 'Instagram Reels', 'YouTube Shorts'],
-            'beauty': ['Instagram Reels', 'TikTok', 'YouTube Shorts'],
-            'lifestyle': ['Instagram Reels', 'Pinterest', 'TikTok'],
-            'comedy': ['TikTok', 'Instagram Reels', 'YouTube Shorts'],
-            'general': ['TikTok', 'Instagram Reels', 'YouTube Shorts']
-        }
+        if not isinstance(prompts, list) or not prompts:
+            return jsonify({'error': 'A non-empty list of prompts is required'}), 400
         
-        suggested_platforms = platform_mapping.get(content_category, ['TikTok', 'Instagram Reels', 'YouTube Shorts'])
+        if len(prompts) > BATCH_MAX_PROMPTS:
+            return jsonify({'error': f'At most {BATCH_MAX_PROMPTS} prompts per batch'}), 413
         
-        response = {
-            'success': True,
-            'description': enhanced_description,
-            'appliedTrends': [trend['name'] for trend in applied_trends],
-            'estimatedViralScore': viral_score,
-            'suggestedPlatforms': suggested_platforms,
-            'contentCategory': content_category,
-            'processingTime': round(processing_time, 2),
-            'generatedAt': int(time.time()),
-            'recommendations': {
-                'bestPostingTime': '6-9 PM or 12-3 PM',
-                'suggestedHashtags': f"#{content_category}video #viral #trending #fyp",
-                'estimatedReach': f"{random.randint(10, 100)}K - {random.randint(500, 2000)}K views"
-            }
-        }
+        over_quota = _check_quota(len(prompts))
+        if over_quota:
+            return over_quota
+        
+        record = _generation_recorder()
+        
+        if _wants_async(data):
+            return _submit_job(generate_batch_and_record, record, prompts)
         
-        return jsonify(response)
+        return jsonify(generate_batch_and_record(record, prompts))
         
     except Exception as e:
         return jsonify({
@@ -229,47 +545,204 @@ def generate_video():
             'message': str(e)
         }), 500
 
+def _job_status(job):
+    return {
+        'jobId': job['id'],
+        'status': job['status'],
+        'submittedAt': int(job['submitted_at']),
+        'startedAt': int(job['started_at']) if job['started_at'] else None,
+        'finishedAt': int(job['finished_at']) if job['finished_at'] else None
+    }
+
+@video_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Get the status of a queued video generation job (from any worker on the host, see JobQueue)"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    status = _job_status(job)
+    if job['status'] == 'finished':
+        status['result'] = job['result']
+    elif job['status'] == 'failed':
+        status['error'] = job['error']
+    
+    return jsonify(status)
+
+@video_bp.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Get the result of a finished video generation job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job['status'] == 'failed':
+        return jsonify({
+            'error': 'Video generation failed',
+            'message': job['error']
+        }), 500
+    
+    if job['status'] != 'finished':
+        # Not ready yet, tell the client to keep polling
+        return jsonify(_job_status(job)), 202
+    
+    return jsonify(job['result'])
+
+RISING_LIMIT = 5
+
+# Response key of each element type on /trending-elements
+TREND_TYPE_KEYS = {'sound': 'sounds', 'effect': 'effects', 'meme': 'memes'}
+TRENDING_DEFAULT_K = 5
+TRENDING_MAX_K = 100
+
+def top_trending(element_type, k=TRENDING_DEFAULT_K, category=None):
+    """Most popular elements of a type, read from the in-memory trend index"""
+    return [
+        {
+            'name': entry['name'],
+            'popularity': entry['popularity'],
+            'category': entry['category']
+        }
+        for entry in trend_index.top(element_type, k, category)
+    ]
+
+def build_trending_payload():
+    """Current trending elements with enhanced data"""
+    sounds = top_trending('sound')
+    effects = top_trending('effect')
+    memes = top_trending('meme')
+    
+    # Elements whose popularity is climbing fastest, from the recorded history
+    rising = []
+    if current_app.config.get('DB_AVAILABLE'):
+        try:
+            popularity_series.maybe_refresh()
+            rising = popularity_series.rank(RISING_LIMIT, by='velocity')
+        except Exception as e:
+            print(f"Popularity ranking failed: {e}")
+    
+    return {
+        'sounds': sounds,
+        'effects': effects,
+        'memes': memes,
+        'rising': rising,
+        'lastUpdated': datetime.now().isoformat(),
+        'totalTrends': len(sounds) + len(effects) + len(memes)
+    }
+
+# Shown until generations have been recorded
+SAMPLE_TOP_CATEGORIES = (
+    {'category': 'dance', 'avgViralScore': 89, 'growth': '+12%'},
+    {'category': 'food', 'avgViralScore': 85, 'growth': '+8%'},
+    {'category': 'pet', 'avgViralScore': 87, 'growth': '+15%'},
+    {'category': 'comedy', 'avgViralScore': 83, 'growth': '+5%'}
+)
+
+TOP_CATEGORIES_LIMIT = 4
+
+def top_performing_categories(today=None):
+    """Most generated categories of the last 7 days with their average score and week-over-week growth
+
+    Reads at most 14 rollup rows per category, however large the history is.
+    """
+    from src.models.user import CategoryDailyRollup
+    
+    today = today or datetime.utcnow().date()
+    week_start = today - timedelta(days=6)
+    this_week, last_week = {}, {}
+    for (day, category), (generations, viral_score_sum) in CategoryDailyRollup.totals_since(today - timedelta(days=13)).items():
+        week = this_week if day >= week_start else last_week
+        totals = week.setdefault(category, [0, 0.0])
+        totals[0] += generations
+        totals[1] += viral_score_sum
+    
+    categories = []
+    for category, (generations, viral_score_sum) in this_week.items():
+        if not generations:
+            continue
+        previous = last_week.get(category, [0, 0.0])[0]
+        categories.append({
+            'category': category,
+            'avgViralScore': round(viral_score_sum / generations),
+            'growth': f"{(generations - previous) / previous * 100:+.0f}%" if previous else 'new',
+            'generations': generations
+        })
+    categories.sort(key=lambda c: c['generations'], reverse=True)
+    return categories[:TOP_CATEGORIES_LIMIT]
+
+def build_analytics_payload():
+    """Viral content analytics and insights"""
+    top_categories = []
+    if current_app.config.get('DB_AVAILABLE'):
+        try:
+            top_categories = top_performing_categories()
+        except Exception as e:
+            print(f"Analytics rollup query failed: {e}")
+    
+    return {
+        'topPerformingCategories': top_categories or [dict(c) for c in SAMPLE_TOP_CATEGORIES],
+        'platformInsights': {
+            'TikTok': {'bestTime': '6-9 PM', 'engagement': 'High', 'trending': 'Dance & Comedy'},
+            'Instagram': {'bestTime': '12-3 PM', 'engagement': 'Medium-High', 'trending': 'Beauty & Lifestyle'},
+            'YouTube': {'bestTime': '7-10 PM', 'engagement': 'Medium', 'trending': 'Tutorials & Reviews'}
+        },
+        'viralFactors': [
+            'Hook within first 3 seconds',
+            'Trending audio usage',
+            'Strong visual appeal',
+            'Relatable content',
+            'Clear call-to-action'
+        ]
+    }
+
+# The dashboard polls these constantly, so each payload is built once per
+# interval and served from memory with an ETag
+trending_cache = SnapshotCache(build_trending_payload, int(os.environ.get('TRENDING_CACHE_TTL', 30)))
+analytics_cache = SnapshotCache(build_analytics_payload, int(os.environ.get('ANALYTICS_CACHE_TTL', 300)))
+
 @video_bp.route('/trending-elements', methods=['GET'])
 def get_trending_elements():
-    """Get current trending elements with enhanced data"""
+    """Get current trending elements with enhanced data
+    
+    ?type= (sound, effect or meme), ?category= and ?k= (1-100) select a
+    filtered top-k; without them the cached default payload is served.
+    """
     try:
-        # Simulate slight variations in popularity (trending elements change over time)
-        sounds = []
-        for sound in TRENDING_SOUNDS[:5]:  # Return top 5
-            popularity_variance = random.randint(-3, 3)
-            sounds.append({
-                'name': sound['name'],
-                'popularity': max(70, min(98, sound['popularity'] + popularity_variance)),
-                'category': sound['category']
-            })
+        if not any(name in request.args for name in ('type', 'category', 'k')):
+            return trending_cache.response()
         
-        effects = []
-        for effect in TRENDING_EFFECTS[:5]:  # Return top 5
-            popularity_variance = random.randint(-3, 3)
-            effects.append({
-                'name': effect['name'],
-                'popularity': max(70, min(98, effect['popularity'] + popularity_variance)),
-                'category': effect['category']
-            })
+        element_type = request.args.get('type')
+        if element_type is not None:
+            # Accept the plural response keys too (?type=sounds)
+            element_type = {key: t for t, key in TREND_TYPE_KEYS.items()}.get(element_type, element_type)
+            if element_type not in TREND_TYPE_KEYS:
+                return jsonify({'error': f"type must be one of {', '.join(TREND_TYPE_KEYS)}"}), 400
         
-        memes = []
-        for meme in TRENDING_MEMES[:5]:  # Return top 5
-            popularity_variance = random.randint(-3, 3)
-            memes.append({
-                'name': meme['name'],
-                'popularity': max(70, min(98, meme['popularity'] + popularity_variance)),
-                'category': meme['category']
-            })
+        try:
+            k = int(request.args.get('k', TRENDING_DEFAULT_K))
+        except ValueError:
+            k = 0
+        if not 1 <= k <= TRENDING_MAX_K:
+            return jsonify({'error': f'k must be between 1 and {TRENDING_MAX_K}'}), 400
         
-        trending_data = {
-            'sounds': sounds,
-            'effects': effects,
-            'memes': memes,
+        category = request.args.get('category') or None
+        
+        payload = {}
+        total = 0
+        for t in ([element_type] if element_type else TREND_TYPE_KEYS):
+            payload[TREND_TYPE_KEYS[t]] = top_trending(t, k, category)
+            total += len(payload[TREND_TYPE_KEYS[t]])
+        payload.update({
+            'type': element_type,
+            'category': category,
+            'k': k,
             'lastUpdated': datetime.now().isoformat(),
-            'totalTrends': len(sounds) + len(effects) + len(memes)
-        }
+            'totalTrends': total
+        })
         
-        return jsonify(trending_data)
+        response = jsonify(payload)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
         
     except Exception as e:
         return jsonify({
@@ -281,31 +754,10 @@ def get_trending_elements():
 def get_analytics():
     """Get viral content analytics and insights"""
     try:
-        analytics_data = {
-            'topPerformingCategories': [
-                {'category': 'dance', 'avgViralScore': 89, 'growth': '+12%'},
-                {'category': 'food', 'avgViralScore': 85, 'growth': '+8%'},
-                {'category': 'pet', 'avgViralScore': 87, 'growth': '+15%'},
-                {'category': 'comedy', 'avgViralScore': 83, 'growth': '+5%'}
-            ],
-            'platformInsights': {
-                'TikTok': {'bestTime': '6-9 PM', 'engagement': 'High', 'trending': 'Dance & Comedy'},
-                'Instagram': {'bestTime': '12-3 PM', 'engagement': 'Medium-High', 'trending': 'Beauty & Lifestyle'},
-                'YouTube': {'bestTime': '7-10 PM', 'engagement': 'Medium', 'trending': 'Tutorials & Reviews'}
-            },
-            'viralFactors': [
-                'Hook within first 3 seconds',
-                'Trending audio usage',
-                'Strong visual appeal',
-                'Relatable content',
-                'Clear call-to-action'
-            ]
-        }
-        
-        return jsonify(analytics_data)
+        return analytics_cache.response()
         
     except Exception as e:
         return jsonify({
             'error': 'Failed to fetch analytics',
             'message': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
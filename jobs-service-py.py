@@ -0,0 +1,146 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no free slots"""
+
+
+class JobQueue:
+    """Bounded pool of background workers for long-running generation jobs
+
+    A job runs in the process that accepted it, but its record (status and
+    result) is kept in a SQLite file shared by all workers on the host, so
+    polling /api/jobs/<id> works whichever worker gets the request. Finished
+    and failed jobs are purged result_ttl seconds after they finish. Jobs
+    still queued or running stuck_ttl seconds after submission (e.g. their
+    worker was restarted) are marked failed as lost, and purged like any
+    other failed job.
+    """
+
+    def __init__(self, workers=None, max_queue=None, result_ttl=None, path=None, stuck_ttl=None):
+        self.workers = workers or int(os.environ.get('JOB_WORKERS', 4))
+        self.max_queue = max_queue or int(os.environ.get('JOB_QUEUE_DEPTH', 100))
+        self.result_ttl = result_ttl or int(os.environ.get('JOB_RESULT_TTL', 600))
+        self.stuck_ttl = stuck_ttl or int(os.environ.get('JOB_STUCK_TTL', 86400))
+        self.path = path or os.environ.get(
+            'JOB_STORE', os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'database', 'jobs.db'))
+
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads = []
+        self._pid = None
+        self._schema_pid = None
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so start them lazily in the process
+        # that actually serves requests (safe with gunicorn --preload)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _connection(self):
+        # One connection per thread, opened lazily (and again after a fork)
+        # so importing the app creates no files
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        if self._schema_pid != os.getpid():
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, '
+                'error TEXT, submitted_at REAL NOT NULL, started_at REAL, finished_at REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_jobs_submitted_at ON jobs (submitted_at)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_jobs_finished_at ON jobs (finished_at)')
+            self._schema_pid = os.getpid()
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) and return the new job id"""
+        self._ensure_started()
+        self._purge_expired()
+
+        job_id = uuid.uuid4().hex
+        self._connection().execute('INSERT INTO jobs (id, status, submitted_at) VALUES (?, ?, ?)',
+                                   (job_id, 'queued', time.time()))
+        try:
+            self._queue.put_nowait((job_id, func, args, kwargs))
+        except queue.Full:
+            self._connection().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            raise QueueFullError(f'Job queue is full ({self.max_queue} pending jobs)')
+        return job_id
+
+    def get(self, job_id):
+        """Return the job record, or None if unknown or expired"""
+        self._purge_expired()
+        row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def stats(self):
+        """Return this process' queue depth and job counts by status (all workers)"""
+        counts = dict(self._connection().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'queued': self._queue.qsize(),
+            'jobs': counts
+        }
+
+    def _worker(self):
+        while True:
+            job_id, func, args, kwargs = self._queue.get()
+            self._update(job_id, status='running', started_at=time.time())
+            try:
+                result = func(*args, **kwargs)
+                update = {'status': 'finished', 'result': json.dumps(result, separators=(',', ':'))}
+            except Exception as e:
+                update = {'status': 'failed', 'error': str(e)}
+            update['finished_at'] = time.time()
+            self._update(job_id, **update)
+            self._queue.task_done()
+
+    def _update(self, job_id, **values):
+        columns = ', '.join(f'{column} = ?' for column in values)
+        try:
+            self._connection().execute(f'UPDATE jobs SET {columns} WHERE id = ?', tuple(values.values()) + (job_id,))
+        except sqlite3.Error as e:
+            print(f"Updating job {job_id} failed: {e}")
+
+    def _purge_expired(self):
+        # Only jobs that are done expire; a queued or running job is given
+        # up on as lost much later, and then expires like any failed job
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Job was lost before it finished', finished_at = ? "
+            "WHERE submitted_at < ? AND status IN ('queued', 'running')", (now, now - self.stuck_ttl))
+        connection.execute('DELETE FROM jobs WHERE finished_at < ?', (now - self.result_ttl,))
+
+
+job_queue = JobQueue()
@@ -0,0 +1,274 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import g, request
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Request, error and database metrics exposed in Prometheus text format
+
+    Each process keeps plain in-memory counters behind one lock. With
+    METRICS_DIR set (one directory shared by all gunicorn workers), every
+    worker also writes its counters to its own file at most once per
+    sync_interval, and the exposition sums the files of all workers.
+    """
+
+    def __init__(self, directory=None, sync_interval=None):
+        self.directory = directory or os.environ.get('METRICS_DIR')
+        self.sync_interval = sync_interval or float(os.environ.get('METRICS_SYNC_INTERVAL', 1))
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._latency = {}
+        self._in_flight = {}
+        self._errors = {}
+        self._queries = _Histogram(QUERY_BUCKETS)
+        self._collectors = {}
+        self._collector_counters = {}
+        self._synced_at = 0.0
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def instrument_engine(self, engine):
+        """Count and time every SQL statement run through an engine"""
+        from sqlalchemy import event
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            duration = time.perf_counter() - conn.info['metrics_query_start'].pop()
+            with self._lock:
+                self._queries.observe(duration)
+
+    @staticmethod
+    def _route():
+        rule = request.url_rule
+        return (request.blueprint or 'app', rule.rule if rule is not None else '<unmatched>')
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        route = self._route()
+        with self._lock:
+            self._in_flight[route] = self._in_flight.get(route, 0) + 1
+
+    def _teardown_request(self, exc):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        route = self._route()
+        status = str(getattr(g, 'metrics_status', 500 if exc is not None else 200))
+        key = route + (request.method, status)
+        with self._lock:
+            self._in_flight[route] -= 1
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._latency.get(route)
+            if histogram is None:
+                histogram = self._latency[route] = _Histogram(LATENCY_BUCKETS)
+            histogram.observe(duration)
+        if self.directory and time.monotonic() - self._synced_at >= self.sync_interval:
+            self.sync()
+
+    def _after_request(self, response):
+        # The teardown handler doesn't see the response, only whether it raised
+        g.metrics_status = response.status_code
+        return response
+
+    def record_error(self, status):
+        """Count an error handled by the app's error handlers"""
+        key = (str(status),)
+        with self._lock:
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    def register_collector(self, name, collect, counters=()):
+        """Export the numbers returned by collect() as viralcraft_<name>{stat="..."} gauges
+
+        Stats named in counters only ever grow (hits, misses, ...) and are
+        exported as viralcraft_<name>_<stat>_total counters instead.
+        """
+        self._collectors[name] = collect
+        self._collector_counters[name] = frozenset(counters)
+
+    def snapshot(self):
+        """JSON-serializable copy of this process' metrics"""
+        def histogram(h):
+            return {'counts': list(h.counts), 'sum': h.sum, 'count': h.count}
+
+        collected = {name: collect() for name, collect in self._collectors.items()}
+        with self._lock:
+            return {
+                'collected': collected,
+                'pid': os.getpid(),
+                'requests': [[list(k), v] for k, v in self._requests.items()],
+                'latency': [[list(k), histogram(h)] for k, h in self._latency.items()],
+                'in_flight': [[list(k), v] for k, v in self._in_flight.items()],
+                'errors': [[list(k), v] for k, v in self._errors.items()],
+                'queries': histogram(self._queries)
+            }
+
+    def sync(self):
+        """Write this worker's metrics file (atomically) for the other workers to read"""
+        self._synced_at = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _snapshots(self):
+        if not self.directory:
+            return [self.snapshot()]
+        self.sync()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def render(self):
+        """All workers' metrics in Prometheus text exposition format"""
+        requests, in_flight, errors, collected, collected_counters = {}, {}, {}, {}, {}
+        latency = {}
+        queries = {'counts': [0] * len(QUERY_BUCKETS), 'sum': 0.0, 'count': 0}
+
+        def add_histogram(target, source):
+            target['counts'] = [a + b for a, b in zip(target['counts'], source['counts'])]
+            target['sum'] += source['sum']
+            target['count'] += source['count']
+
+        for snapshot in self._snapshots():
+            # Counters of exited workers still count; their in-flight gauges don't
+            alive = snapshot['pid'] == os.getpid() or self._alive(snapshot['pid'])
+            for key, value in snapshot['requests']:
+                requests[tuple(key)] = requests.get(tuple(key), 0) + value
+            for key, value in snapshot['errors']:
+                errors[tuple(key)] = errors.get(tuple(key), 0) + value
+            for name, values in snapshot.get('collected', {}).items():
+                counters = self._collector_counters.get(name, ())
+                for stat, value in values.items():
+                    if stat in counters:
+                        metric = f'{name}_{stat}'
+                        collected_counters[metric] = collected_counters.get(metric, 0) + value
+                    elif alive:
+                        totals = collected.setdefault(name, {})
+                        totals[stat] = totals.get(stat, 0) + value
+            if alive:
+                for key, value in snapshot['in_flight']:
+                    in_flight[tuple(key)] = in_flight.get(tuple(key), 0) + value
+            for key, h in snapshot['latency']:
+                target = latency.setdefault(tuple(key), {'counts': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+                add_histogram(target, h)
+            add_histogram(queries, snapshot['queries'])
+
+        lines = []
+
+        def labels(names, values, extra=''):
+            pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+            if extra:
+                pairs.append(extra)
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        def histogram_lines(name, names, key, h, buckets):
+            cumulative = 0
+            for bound, count in zip(buckets, h['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{labels(names, key, _le(bound))} {cumulative}')
+            lines.append(f'{name}_bucket{labels(names, key, _le("+Inf"))} {h["count"]}')
+            lines.append(f'{name}_sum{labels(names, key)} {h["sum"]}')
+            lines.append(f'{name}_count{labels(names, key)} {h["count"]}')
+
+        route_labels = ('blueprint', 'route')
+
+        lines.append('# HELP viralcraft_http_requests_total HTTP requests handled.')
+        lines.append('# TYPE viralcraft_http_requests_total counter')
+        for key, value in sorted(requests.items()):
+            lines.append(f'viralcraft_http_requests_total{labels(route_labels + ("method", "status"), key)} {value}')
+
+        lines.append('# HELP viralcraft_http_request_duration_seconds HTTP request latency.')
+        lines.append('# TYPE viralcraft_http_request_duration_seconds histogram')
+        for key, h in sorted(latency.items()):
+            histogram_lines('viralcraft_http_request_duration_seconds', route_labels, key, h, LATENCY_BUCKETS)
+
+        lines.append('# HELP viralcraft_http_requests_in_flight HTTP requests being handled.')
+        lines.append('# TYPE viralcraft_http_requests_in_flight gauge')
+        for key, value in sorted(in_flight.items()):
+            lines.append(f'viralcraft_http_requests_in_flight{labels(route_labels, key)} {value}')
+
+        lines.append('# HELP viralcraft_http_errors_total Responses produced by the error handlers.')
+        lines.append('# TYPE viralcraft_http_errors_total counter')
+        for key, value in sorted(errors.items()):
+            lines.append(f'viralcraft_http_errors_total{labels(("status",), key)} {value}')
+
+        lines.append('# HELP viralcraft_db_query_duration_seconds SQL statement latency.')
+        lines.append('# TYPE viralcraft_db_query_duration_seconds histogram')
+        histogram_lines('viralcraft_db_query_duration_seconds', (), (), queries, QUERY_BUCKETS)
+
+        # Collectors report per-process state, summed over the running workers
+        for name, values in sorted(collected.items()):
+            lines.append(f'# TYPE viralcraft_{name} gauge')
+            for stat, value in sorted(values.items()):
+                lines.append(f'viralcraft_{name}{labels(("stat",), (stat,))} {value}')
+
+        # and per-process counts, summed over every worker like the request counters
+        for name, value in sorted(collected_counters.items()):
+            lines.append(f'# TYPE viralcraft_{name}_total counter')
+            lines.append(f'viralcraft_{name}_total {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _le(bound):
+    return f'le="{bound}"'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
@@ -0,0 +1,95 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+
+class HasherBusyError(Exception):
+    """Raised when too many password operations are queued or one waited past the timeout"""
+
+
+def full_method(method):
+    """Method string as werkzeug records it in a hash, e.g. 'pbkdf2' -> 'pbkdf2:sha256:600000'"""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = args if len(args) == 3 else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    return method
+
+
+class PasswordHasher:
+    """Runs password hashes and checks on a small thread pool per worker
+
+    The KDF (scrypt, pbkdf2) runs on one of `workers` pool threads while
+    the request thread blocks on its result for at most `timeout` seconds.
+    With threaded workers (gunicorn --threads or gthread) this caps the
+    CPU spent on KDFs at `workers` at a time; operations beyond
+    `max_pending` queued ones, and waits that time out, raise
+    HasherBusyError (503 with Retry-After) instead of piling up behind
+    every other request. With sync workers a worker only handles one
+    request at a time, so the pool makes no difference there.
+    """
+
+    def __init__(self, method=None, workers=None, max_pending=None, timeout=None):
+        self.method = method or os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+        self.workers = workers or int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+        self.max_pending = max_pending or int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+        self.timeout = timeout or float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._current_params = None
+
+    def _get_executor(self):
+        # Created lazily so each forked worker gets its own threads
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix='password-hash')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusyError('Too many password operations in progress')
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The KDF keeps its slot until it finishes, so a backlog stays bounded
+            raise HasherBusyError(f'Password operation took longer than {self.timeout:g}s')
+
+    def hash(self, password):
+        """Hash a password with the configured method and cost"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        """Check a password against a stored hash"""
+        return self._run(check_password_hash, password_hash, password)
+
+    @property
+    def current_params(self):
+        """Full method string (e.g. pbkdf2:sha256:600000) new hashes are made with"""
+        if self._current_params is None:
+            self._current_params = full_method(self.method)
+        return self._current_params
+
+    def needs_rehash(self, password_hash):
+        """True if a stored hash was made with other parameters than the current ones"""
+        return password_hash.split('$', 1)[0] != self.current_params
+
+
+password_hasher = PasswordHasher()
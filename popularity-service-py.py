@@ -0,0 +1,330 @@
+import atexit
+import contextlib
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+
+# Samples older than this many half-lives weigh less than 0.4% and are dropped
+HORIZON_HALF_LIVES = 8
+
+
+def _timestamp(value):
+    """Epoch seconds of a naive UTC datetime (as stored by the models)"""
+    return value.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+class PopularitySeries:
+    """Recent popularity samples of every trending element, as NumPy ring buffers
+
+    A sample is the number of recorded generations that applied the element
+    during one sample_interval. Each worker counts its own generations and
+    writes one sample per element and interval (every sample_interval
+    seconds, or as soon as flush_size elements have counts); samples of the
+    same interval are summed when loaded.
+
+    Each element owns one row of a (elements x window) array of values and
+    timestamps, so scoring and ranking the whole catalog is a handful of
+    array operations. An interval without a sample had no generations and
+    counts as zero, and elements with no sample in the last window
+    intervals are left out of the rankings. Samples are persisted in bulk to
+    trending_element_samples and every worker loads new ones from there
+    (at most every refresh_interval seconds), so all workers rank the same
+    history.
+    """
+
+    def __init__(self, window=None, half_life=None, refresh_interval=None, flush_size=None,
+                 sample_interval=None):
+        self.window = window or int(os.environ.get('POPULARITY_WINDOW', 48))
+        # Seconds after which a sample counts half as much
+        self.half_life = half_life or float(os.environ.get('POPULARITY_HALF_LIFE', 6 * 3600))
+        self.refresh_interval = float(refresh_interval if refresh_interval is not None
+                                      else os.environ.get('POPULARITY_REFRESH_INTERVAL', 30))
+        self.flush_size = flush_size or int(os.environ.get('POPULARITY_FLUSH_SIZE', 200))
+        self.sample_interval = sample_interval or float(os.environ.get('POPULARITY_SAMPLE_INTERVAL', 300))
+
+        self.names = []
+        self._rows = {}
+        self.values = np.zeros((0, self.window), dtype=np.float32)
+        self.times = np.zeros((0, self.window), dtype=np.float64)
+        self.heads = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+
+        self._generations = {}
+        self._pending = []
+        self._last_sample_id = 0
+        self._refreshed_at = None
+        self._pruned_at = 0.0
+        self._lock = threading.RLock()
+        self._app = None
+        self._pid = None
+
+    def init_app(self, app):
+        """Count the trends applied by every batch record_generations stores"""
+        from src.models.user import generation_listeners
+
+        self._app = app
+        if self.count not in generation_listeners:
+            generation_listeners.append(self.count)
+        atexit.register(self.sample)
+
+    def count(self, usage):
+        """Add {element_id: generations} to the counts of the current interval"""
+        with self._lock:
+            for element_id, generations in usage.items():
+                self._generations[element_id] = self._generations.get(element_id, 0) + generations
+            full = len(self._generations) >= self.flush_size
+        self._ensure_timer()
+        if full:
+            try:
+                self.sample()
+            except Exception as e:
+                # Kept queued for the next flush
+                print(f"Writing popularity samples failed: {e}")
+
+    def _ensure_timer(self):
+        # Started lazily so each forked worker runs its own sampler
+        if self._app is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run_timer, name='popularity-sample', daemon=True).start()
+
+    def _run_timer(self):
+        while True:
+            time.sleep(self.sample_interval)
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Writing popularity samples failed: {e}")
+
+    def sample(self):
+        """Turn the generation counts so far into samples and write them"""
+        # Stamped with the start of the interval, so every worker's sample for
+        # it gets the same timestamp
+        at = datetime.datetime.utcfromtimestamp(time.time() // self.sample_interval * self.sample_interval)
+        with self._lock:
+            generations, self._generations = self._generations, {}
+            for element_id, count in generations.items():
+                self._pending.append({'trending_element_id': element_id, 'popularity': float(count),
+                                      'recorded_at': at})
+        return self.flush()
+
+    # Storage
+
+    def _row(self, name):
+        row = self._rows.get(name)
+        if row is None:
+            row = self._rows[name] = len(self.names)
+            self.names.append(name)
+            if row >= len(self.heads):
+                # Grow by doubling so loading n elements copies O(n) rows in total
+                capacity = max(64, 2 * len(self.heads))
+                self.values = np.resize(self.values, (capacity, self.window))
+                self.times = np.resize(self.times, (capacity, self.window))
+                self.heads = np.resize(self.heads, capacity)
+                self.counts = np.resize(self.counts, capacity)
+                self.heads[row:] = 0
+                self.counts[row:] = 0
+        return row
+
+    def add(self, name, popularity, at):
+        """Put a sample in an element's ring buffer, overwriting its oldest once full
+
+        A sample with the same timestamp as the latest one (another worker's
+        count for the same interval) is added to it.
+        """
+        with self._lock:
+            row = self._row(name)
+            head = self.heads[row]
+            if self.counts[row] and self.times[row, head - 1] == at:
+                self.values[row, head - 1] += popularity
+                return
+            self.values[row, head] = popularity
+            self.times[row, head] = at
+            self.heads[row] = (head + 1) % self.window
+            self.counts[row] = min(self.counts[row] + 1, self.window)
+
+    def clear(self):
+        with self._lock:
+            self.names = []
+            self._rows = {}
+            self.heads = np.zeros(0, dtype=np.int64)
+            self.counts = np.zeros(0, dtype=np.int64)
+            self._last_sample_id = 0
+            self._refreshed_at = None
+
+    # Persistence
+
+    def _engine(self):
+        from src.models.user import db
+        return db.engine
+
+    def _app_context(self):
+        return self._app.app_context() if self._app is not None else contextlib.nullcontext()
+
+    def flush(self):
+        """Write queued samples with one executemany INSERT"""
+        from src.models.user import TrendingElementSample
+
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        try:
+            with self._app_context():
+                with self._engine().begin() as connection:
+                    connection.execute(TrendingElementSample.__table__.insert(), pending)
+        except Exception:
+            with self._lock:
+                self._pending = pending + self._pending
+            raise
+        return len(pending)
+
+    def refresh(self):
+        """Load samples written (by any worker) since the last refresh"""
+        from src.models.user import TrendingElement, TrendingElementSample
+
+        self.flush()
+        samples = TrendingElementSample.__table__
+        elements = TrendingElement.__table__
+        now = time.time()
+        query = (samples.select()
+                 .with_only_columns(samples.c.id, elements.c.name, samples.c.popularity, samples.c.recorded_at)
+                 .join_from(samples, elements, samples.c.trending_element_id == elements.c.id)
+                 .where(samples.c.id > self._last_sample_id)
+                 .order_by(samples.c.id))
+        if self._last_sample_id == 0:
+            horizon = datetime.datetime.utcfromtimestamp(now - HORIZON_HALF_LIVES * self.half_life)
+            query = query.where(samples.c.recorded_at >= horizon)
+
+        loaded = 0
+        with self._lock:
+            with self._app_context():
+                with self._engine().connect() as connection:
+                    for sample_id, name, popularity, recorded_at in connection.execute(query):
+                        self.add(name, popularity, _timestamp(recorded_at))
+                        self._last_sample_id = sample_id
+                        loaded += 1
+                    if now - self._pruned_at > 3600:
+                        self._pruned_at = now
+                        self._prune(connection, now)
+                        self._prune_rows(now)
+            self._refreshed_at = time.monotonic()
+        return loaded
+
+    def _prune(self, connection, now):
+        from src.models.user import TrendingElementSample
+
+        samples = TrendingElementSample.__table__
+        horizon = datetime.datetime.utcfromtimestamp(now - HORIZON_HALF_LIVES * self.half_life)
+        connection.execute(samples.delete().where(samples.c.recorded_at < horizon))
+        connection.commit()
+
+    def _prune_rows(self, now):
+        """Drop buffered samples past the horizon, and elements left without any"""
+        horizon = now - HORIZON_HALF_LIVES * self.half_life
+        with self._lock:
+            n = len(self.names)
+            # Ring slots from oldest to newest, so the kept samples are a suffix
+            slots = (self.heads[:n, None] + np.arange(self.window)) % self.window
+            times = np.take_along_axis(self.times[:n], slots, axis=1)
+            used = np.arange(self.window) >= self.window - self.counts[:n, None]
+            self.counts[:n] = (used & (times >= horizon)).sum(axis=1)
+
+            keep = np.flatnonzero(self.counts[:n] > 0)
+            if len(keep) == n:
+                return
+            self.names = [self.names[i] for i in keep]
+            self._rows = {name: row for row, name in enumerate(self.names)}
+            self.values = self.values[keep]
+            self.times = self.times[keep]
+            self.heads = self.heads[keep]
+            self.counts = self.counts[keep]
+
+    def maybe_refresh(self):
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self.refresh()
+
+    # Scoring
+
+    def scores(self, now=None):
+        """(names, decayed score, velocity, recent sample count) arrays for the whole catalog
+
+        The decayed score is the exponentially weighted average popularity,
+        faded by the age of the latest sample so elements that stop being
+        updated drop out. Velocity is the least-squares slope of popularity
+        over the completed intervals since the element's oldest sample in the
+        window, in points per hour (positive = rising); intervals without a
+        sample count as zero, so an element that went idle stops rising.
+        The sample count only covers the last window intervals.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            n = len(self.names)
+            names = list(self.names)
+            values = self.values[:n].astype(np.float64)
+            times = self.times[:n]
+            counts = self.counts[:n]
+
+        valid = np.arange(self.window) < counts[:, None]
+        ages = np.where(valid, now - times, np.inf)
+        weights = np.exp2(-ages / self.half_life)
+        weight_sum = weights.sum(axis=1)
+        average = np.divide((weights * values).sum(axis=1), weight_sum,
+                            out=np.zeros(n), where=weight_sum > 0)
+        freshness = np.exp2(-ages.min(axis=1, initial=np.inf) / self.half_life)
+        decayed = average * freshness
+
+        # Regress over every completed interval from the element's oldest
+        # sample in the window up to now, where a missing sample is a zero:
+        # the grid sums come from prefix sums, only samples add to sy and sxy
+        interval = self.sample_interval
+        end = now // interval * interval
+        recent = valid & (times >= end - self.window * interval)
+        in_grid = recent & (times < end)
+        starts = times // interval * interval
+        grid = (end - interval * np.arange(1, self.window + 1) - now) / 3600.0
+        span = np.where(in_grid, (end - starts) // interval, 0).max(axis=1, initial=0).astype(np.int64)
+        last = np.maximum(span - 1, 0)
+        sx = np.where(span > 0, np.cumsum(grid)[last], 0.0)
+        sxx = np.where(span > 0, np.cumsum(grid * grid)[last], 0.0)
+        hours = np.where(in_grid, (starts - now) / 3600.0, 0.0)
+        y = np.where(in_grid, values, 0.0)
+        denominator = span * sxx - sx * sx
+        velocity = np.divide(span * (hours * y).sum(axis=1) - sx * y.sum(axis=1), denominator,
+                             out=np.zeros(n), where=denominator > 1e-12)
+
+        return names, decayed, velocity, recent.sum(axis=1)
+
+    def rank(self, k=10, by='score', now=None, min_samples=1):
+        """Top k elements by decayed score or by velocity ('rising')"""
+        names, decayed, velocity, counts = self.scores(now)
+        key = velocity if by == 'velocity' else decayed
+        eligible = np.flatnonzero(counts >= max(min_samples, 2 if by == 'velocity' else 1))
+        if by == 'velocity':
+            # Compared at the reported precision, so float noise on a flat series isn't rising
+            eligible = eligible[np.round(velocity[eligible], 2) > 0]
+        if k < len(eligible):
+            # O(n) selection of the top k, then sort just those
+            eligible = eligible[np.argpartition(-key[eligible], k - 1)[:k]]
+        order = eligible[np.argsort(-key[eligible], kind='stable')]
+        return [
+            {
+                'name': names[i],
+                'score': round(float(decayed[i]), 2),
+                'velocity': round(float(velocity[i]), 2),
+                'samples': int(counts[i])
+            }
+            for i in order
+        ]
+
+    def __len__(self):
+        return len(self.names)
+
+
+popularity_series = PopularitySeries()
@@ -0,0 +1,213 @@
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from flask import current_app, g, jsonify, request, send_file
+
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_ID_RE = re.compile(r'^[0-9]+-[0-9]+$')
+
+# Longest SQL statement kept in a profile
+MAX_STATEMENT_LENGTH = 2000
+
+
+class RequestProfiler:
+    """Opt-in cProfile + SQL capture for single requests
+
+    A request is profiled when it carries PROFILE_ADMIN_TOKEN in the
+    X-Profile-Token header, or at random with PROFILE_SAMPLE_RATE. Each
+    profile is written to PROFILE_DIR as a pstats file plus a JSON summary
+    and only the newest PROFILE_KEEP are kept; the admin routes that read
+    them need the same token. Without PROFILE_ADMIN_TOKEN profiling is off
+    (PROFILE_SAMPLE_RATE alone is ignored, as its profiles could not be
+    read) and init_app registers nothing, so requests pay nothing.
+    """
+
+    def __init__(self, directory=None, sample_rate=None, admin_token=None, keep=None):
+        self.directory = directory or os.environ.get(
+            'PROFILE_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'database', 'profiles'))
+        self.sample_rate = float(sample_rate if sample_rate is not None else os.environ.get('PROFILE_SAMPLE_RATE', 0))
+        self.admin_token = admin_token if admin_token is not None else os.environ.get('PROFILE_ADMIN_TOKEN')
+        self.keep = keep or int(os.environ.get('PROFILE_KEEP', 50))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.admin_token)
+
+    def init_app(self, app):
+        if not self.enabled:
+            if self.sample_rate > 0:
+                app.logger.warning('PROFILE_SAMPLE_RATE is ignored: set PROFILE_ADMIN_TOKEN to enable profiling')
+            return
+        app.before_request(self._start)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish)
+        self._register_admin_routes(app)
+
+    def instrument_engine(self, engine):
+        """Record the SQL statements run while a request is being profiled"""
+        if not self.enabled:
+            return
+        from sqlalchemy import event
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if getattr(self._local, 'queries', None) is not None:
+                conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            queries = getattr(self._local, 'queries', None)
+            starts = conn.info.get('profile_query_start')
+            if queries is None or not starts:
+                return
+            queries.append({
+                'statement': statement[:MAX_STATEMENT_LENGTH],
+                'durationMs': round((time.perf_counter() - starts.pop()) * 1000, 3),
+                'executemany': executemany
+            })
+
+    def _authorized(self):
+        return bool(self.admin_token) and hmac.compare_digest(
+            request.headers.get(PROFILE_HEADER, '').encode(), self.admin_token.encode())
+
+    def _start(self):
+        if request.path.startswith('/api/admin/profiles'):
+            return
+        if not self._authorized() and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return
+        self._local.queries = []
+        g.profile = profile
+        g.profile_start = time.perf_counter()
+
+    def _record_status(self, response):
+        if 'profile' in g:
+            g.profile_status = response.status_code
+            response.headers['X-Profile-Id'] = g.profile_id = self._new_id()
+        return response
+
+    def _finish(self, exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        duration = time.perf_counter() - g.pop('profile_start')
+        queries = self._local.queries
+        self._local.queries = None
+        try:
+            self._save(profile, {
+                'id': g.get('profile_id') or self._new_id(),
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'route': request.url_rule.rule if request.url_rule is not None else None,
+                'status': g.get('profile_status', 500),
+                'error': repr(exc) if exc is not None else None,
+                'startedAt': time.time() - duration,
+                'durationMs': round(duration * 1000, 3),
+                'queryCount': len(queries),
+                'queryTimeMs': round(sum(q['durationMs'] for q in queries), 3),
+                'queries': queries
+            })
+        except Exception:
+            current_app.logger.exception('Saving request profile failed')
+
+    @staticmethod
+    def _new_id():
+        # Sorts by time across workers
+        return f"{time.time_ns()}-{os.getpid()}"
+
+    def _save(self, profile, summary):
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(40)
+        summary['stats'] = stream.getvalue()
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, summary['id'])
+        profile.dump_stats(base + '.prof')
+        with open(base + '.json.tmp', 'w') as f:
+            json.dump(summary, f)
+        os.replace(base + '.json.tmp', base + '.json')
+        self._trim()
+
+    def _trim(self):
+        with self._lock:
+            ids = self.list_ids()
+            for profile_id in ids[:-self.keep]:
+                for suffix in ('.json', '.prof'):
+                    try:
+                        os.remove(os.path.join(self.directory, profile_id + suffix))
+                    except FileNotFoundError:
+                        pass
+
+    def list_ids(self):
+        """Stored profile ids, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        ids = [name[:-5] for name in os.listdir(self.directory) if name.endswith('.json')]
+        return sorted((i for i in ids if PROFILE_ID_RE.match(i)), key=lambda i: int(i.split('-')[0]))
+
+    def load(self, profile_id):
+        """Summary of a stored profile, or None"""
+        if not PROFILE_ID_RE.match(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, profile_id + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _register_admin_routes(self, app):
+        def forbidden():
+            return jsonify({'error': 'Forbidden', 'message': f'A valid {PROFILE_HEADER} header is required'}), 403
+
+        @app.route('/api/admin/profiles', methods=['GET'])
+        def list_profiles():
+            if not self._authorized():
+                return forbidden()
+            profiles = []
+            for profile_id in reversed(self.list_ids()):
+                summary = self.load(profile_id)
+                if summary is None:
+                    continue
+                summary.pop('queries', None)
+                summary.pop('stats', None)
+                profiles.append(summary)
+            return jsonify({'success': True, 'profiles': profiles})
+
+        @app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+        def get_profile(profile_id):
+            if not self._authorized():
+                return forbidden()
+            summary = self.load(profile_id)
+            if summary is None:
+                return jsonify({'error': 'Profile not found'}), 404
+            return jsonify({'success': True, 'profile': summary})
+
+        @app.route('/api/admin/profiles/<profile_id>/download', methods=['GET'])
+        def download_profile(profile_id):
+            """Raw pstats file, e.g. for snakeviz or python -m pstats"""
+            if not self._authorized():
+                return forbidden()
+            path = os.path.join(self.directory, profile_id + '.prof')
+            if not PROFILE_ID_RE.match(profile_id) or not os.path.exists(path):
+                return jsonify({'error': 'Profile not found'}), 404
+            return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                             download_name=f'{profile_id}.prof')
+
+
+request_profiler = RequestProfiler()
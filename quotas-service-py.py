@@ -0,0 +1,185 @@
+import datetime
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# Per-plan limits: generations per calendar month (None = unlimited) and a
+# token bucket of `burst` requests refilled at `rate` per second
+PLAN_LIMITS = {
+    'free': {'monthly': 5, 'burst': 3, 'rate': 1 / 20},
+    'pro': {'monthly': None, 'burst': 10, 'rate': 1.0},
+    'business': {'monthly': None, 'burst': 20, 'rate': 2.0}
+}
+DEFAULT_PLAN = 'free'
+
+# Callers without an account, metered per client IP: no monthly cap (many
+# visitors can share an address) but a rate limit against floods
+ANONYMOUS_PLAN = 'anonymous'
+ANONYMOUS_LIMITS = {'monthly': None, 'burst': 10, 'rate': 0.5}
+
+# key hash, bucket tokens, bucket updated at, month number, generations used this month
+SLOT = struct.Struct('<QddII')
+MAX_PROBES = 32
+
+QuotaDecision = namedtuple('QuotaDecision', 'allowed reason plan limit remaining retry_after reset_at')
+
+
+def user_key(username):
+    return f'user:{username}'
+
+
+def ip_key(address):
+    return f'ip:{address}'
+
+
+def _month_number(now):
+    date = datetime.datetime.utcfromtimestamp(now)
+    return date.year * 12 + date.month - 1
+
+
+def _month_start(month):
+    year, month = divmod(month, 12)
+    return datetime.datetime(year, month + 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class QuotaStore:
+    """Monthly generation counters and rate-limit buckets shared by all workers
+
+    State lives in a fixed-size memory-mapped file of 32-byte slots (open
+    addressing on a hash of the key), so every gunicorn worker sees the same
+    counters and a check is a lock plus a few struct reads, with no database
+    round trip. An fcntl lock serializes the processes, a thread lock the
+    threads within one. Counters are lost if QUOTA_FILE is deleted.
+    """
+
+    def __init__(self, path=None, slots=None, plans=None):
+        self.path = path or os.environ.get(
+            'QUOTA_FILE', os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'database', 'quotas.bin'))
+        self.slots = slots or int(os.environ.get('QUOTA_SLOTS', 65536))
+        self.plans = plans or PLAN_LIMITS
+        self.enabled = os.environ.get('QUOTAS_ENABLED', '1') != '0'
+        self._file = None
+        self._map = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _mapping(self):
+        # Opened lazily (and again after a fork) so importing the app creates no files
+        if self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            size = self.slots * SLOT.size
+            self._file = open(self.path, 'a+b')
+            if os.fstat(self._file.fileno()).st_size < size:
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+            self._pid = os.getpid()
+        return self._map
+
+    def _locked(self, func, *args):
+        with self._lock:
+            mapping = self._mapping()
+            fcntl.lockf(self._file, fcntl.LOCK_EX)
+            try:
+                return func(mapping, *args)
+            finally:
+                fcntl.lockf(self._file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key):
+        # 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def _find(self, mapping, key_hash, month):
+        """Offset and contents of the key's slot; claims a free or expired slot if it has none"""
+        start = key_hash % self.slots
+        claim = None
+        for probe in range(MAX_PROBES):
+            offset = ((start + probe) % self.slots) * SLOT.size
+            slot = SLOT.unpack_from(mapping, offset)
+            if slot[0] == key_hash:
+                return offset, slot
+            if slot[0] == 0:
+                if claim is None:
+                    claim = offset
+                break
+            # Slots not touched this month can be reused
+            if claim is None and slot[3] != month:
+                claim = offset
+        if claim is None:
+            # Probe window full: evict the least recently used slot
+            claim = min((((start + probe) % self.slots) * SLOT.size for probe in range(MAX_PROBES)),
+                        key=lambda offset: SLOT.unpack_from(mapping, offset)[2])
+        return claim, None
+
+    def _limits(self, plan):
+        if plan == ANONYMOUS_PLAN:
+            return ANONYMOUS_LIMITS
+        return self.plans.get(plan) or self.plans[DEFAULT_PLAN]
+
+    def _decide(self, mapping, key, plan, count, consume):
+        limits = self._limits(plan)
+        now = time.time()
+        month = _month_number(now)
+        key_hash = self._hash(key)
+        offset, slot = self._find(mapping, key_hash, month)
+
+        if slot is None or slot[3] != month:
+            tokens, updated, used = float(limits['burst']), now, 0
+        else:
+            _, tokens, updated, _, used = slot
+            tokens = min(float(limits['burst']), tokens + (now - updated) * limits['rate'])
+
+        monthly = limits['monthly']
+        remaining = None if monthly is None else max(0, monthly - used)
+        next_month = _month_start(month + 1)
+        reset_at = next_month.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        if not consume:
+            return QuotaDecision(True, None, plan, monthly, remaining, 0, reset_at)
+
+        if monthly is not None and used + count > monthly:
+            return QuotaDecision(False, 'monthly', plan, monthly, remaining,
+                                 max(1, int(next_month.timestamp() - now)), reset_at)
+
+        if tokens < 1:
+            SLOT.pack_into(mapping, offset, key_hash, tokens, now, month, used)
+            return QuotaDecision(False, 'rate', plan, monthly, remaining,
+                                 max(1, int((1 - tokens) / limits['rate'] + 0.999)), reset_at)
+
+        used += count
+        SLOT.pack_into(mapping, offset, key_hash, tokens - 1, now, month, used)
+        return QuotaDecision(True, None, plan, monthly, None if monthly is None else monthly - used, 0, reset_at)
+
+    def consume(self, key, plan=DEFAULT_PLAN, count=1):
+        """Charge `count` generations (and one request of rate limit) to a key"""
+        if not self.enabled:
+            return QuotaDecision(True, None, plan, None, None, 0, None)
+        return self._locked(self._decide, key, plan, count, True)
+
+    def status(self, key, plan=DEFAULT_PLAN):
+        """Current allowance of a key, without charging it"""
+        return self._locked(self._decide, key, plan, 0, False)
+
+    def reset(self, key=None):
+        """Clear the counters of one key, or of every key"""
+        def clear(mapping):
+            if key is None:
+                mapping[:] = bytes(len(mapping))
+                return True
+            key_hash = self._hash(key)
+            offset, slot = self._find(mapping, key_hash, _month_number(time.time()))
+            if slot is None:
+                return False
+            SLOT.pack_into(mapping, offset, key_hash, 0.0, 0.0, 0, 0)
+            return True
+        return self._locked(clear)
+
+
+quota_store = QuotaStore()
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from src.services.classifier import CATEGORY_KEYWORDS, DEFAULT_CATEGORY, tokenize
+
+CATEGORIES = [category for category, _ in CATEGORY_KEYWORDS] + [DEFAULT_CATEGORY]
+
+# Words that tend to mark a hook-driven short video
+HOOK_KEYWORDS = frozenset([
+    'challenge', 'viral', 'trend', 'trending', 'hack', 'hacks', 'secret', 'pov', 'ultimate',
+    'transformation', 'reveal', 'vs', 'try', 'trying', 'react', 'reaction', 'first', 'best'
+])
+
+FEATURES = (
+    ['bias', 'long_prompt', 'length_100', 'hook_keywords']
+    + [f'category_{category}' for category in CATEGORIES]
+    + ['trend_count', 'multiple_trends', 'trend_popularity_100']
+)
+_COLUMN = {name: i for i, name in enumerate(FEATURES)}
+
+# The original heuristic: 70, +10 for a detailed prompt, +5 for a popular
+# category, +8 for two or more trends (the random 0-10 bonus comes on top)
+DEFAULT_WEIGHTS = dict.fromkeys(FEATURES, 0.0)
+DEFAULT_WEIGHTS.update({
+    'bias': 70.0,
+    'long_prompt': 10.0,
+    'category_dance': 5.0,
+    'category_food': 5.0,
+    'category_pet': 5.0,
+    'multiple_trends': 8.0
+})
+
+MAX_SCORE = 95
+
+
+def _fill(row, prompt, category, trends):
+    row[_COLUMN['bias']] = 1.0
+    row[_COLUMN['long_prompt']] = len(prompt) > 50
+    row[_COLUMN['length_100']] = len(prompt) / 100.0
+    row[_COLUMN['hook_keywords']] = len(HOOK_KEYWORDS.intersection(tokenize(prompt)))
+    column = _COLUMN.get(f'category_{category}', _COLUMN[f'category_{DEFAULT_CATEGORY}'])
+    row[column] = 1.0
+    row[_COLUMN['trend_count']] = len(trends)
+    row[_COLUMN['multiple_trends']] = len(trends) >= 2
+    row[_COLUMN['trend_popularity_100']] = sum(t.get('popularity') or 0.0 for t in trends) / 100.0
+
+
+def feature_matrix(prompts, categories, trend_lists):
+    """(prompts x FEATURES) matrix; trends are dicts with an optional 'popularity'"""
+    n = len(prompts)
+    matrix = np.zeros((n, len(FEATURES)))
+    # Built a column at a time, so Python only does the per-prompt tokenizing
+    lengths = np.fromiter(map(len, prompts), dtype=np.float64, count=n)
+    trend_counts = np.fromiter(map(len, trend_lists), dtype=np.float64, count=n)
+    default_column = _COLUMN[f'category_{DEFAULT_CATEGORY}']
+
+    matrix[:, _COLUMN['bias']] = 1.0
+    matrix[:, _COLUMN['long_prompt']] = lengths > 50
+    matrix[:, _COLUMN['length_100']] = lengths / 100.0
+    matrix[:, _COLUMN['hook_keywords']] = np.fromiter(
+        (len(HOOK_KEYWORDS.intersection(tokenize(p))) for p in prompts), dtype=np.float64, count=n)
+    matrix[np.arange(n), np.fromiter(
+        (_COLUMN.get(f'category_{c}', default_column) for c in categories), dtype=np.intp, count=n)] = 1.0
+    matrix[:, _COLUMN['trend_count']] = trend_counts
+    matrix[:, _COLUMN['multiple_trends']] = trend_counts >= 2
+    matrix[:, _COLUMN['trend_popularity_100']] = np.fromiter(
+        (sum(t.get('popularity') or 0.0 for t in trends) for trends in trend_lists), dtype=np.float64, count=n) / 100.0
+    return matrix
+
+
+class ViralScoreModel:
+    """Linear viral score over a fixed prompt feature vector
+
+    The default weights reproduce the original if-chain exactly. Every
+    worker loads SCORING_WEIGHTS_FILE on first use if it exists, a JSON
+    {"weights": {feature: weight}} for weights fitted offline against an
+    engagement signal; features it doesn't list keep their default. The
+    recorded viral_score is not such a signal: it is this model's own
+    output, so fitting to it would only learn the weights back.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(
+            'SCORING_WEIGHTS_FILE', os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'database', 'scoring-weights.json'))
+        self.default_weights = np.array([DEFAULT_WEIGHTS[name] for name in FEATURES])
+        self._weights = None
+        self._lock = threading.Lock()
+
+    @property
+    def weights(self):
+        if self._weights is None:
+            with self._lock:
+                if self._weights is None:
+                    self._weights = self._load()
+        return self._weights
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return self.default_weights
+        except (OSError, ValueError) as e:
+            print(f"Ignoring scoring weights in {self.path}: {e}")
+            return self.default_weights
+        # Features the file doesn't list keep their default
+        weights = dict(zip(FEATURES, self.default_weights))
+        weights.update((name, value) for name, value in saved['weights'].items() if name in weights)
+        return np.array([weights[name] for name in FEATURES])
+
+    def reset(self):
+        """Go back to the default weights (in this process)"""
+        self._weights = self.default_weights
+
+    def predict(self, matrix):
+        """Raw scores for a feature matrix, one matrix-vector product"""
+        return matrix @ self.weights
+
+    def score(self, prompt, category, trends):
+        """Score of one prompt, before the random bonus"""
+        row = np.zeros(len(FEATURES))
+        _fill(row, prompt, category, trends)
+        return float(row @ self.weights)
+
+    def score_many(self, prompts, categories, trend_lists):
+        """Scores of a batch of prompts, before the random bonus"""
+        return self.predict(feature_matrix(prompts, categories, trend_lists))
+
+viral_score_model = ViralScoreModel()
@@ -0,0 +1,197 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Files the build lists in its manifest carry a content hash in their name,
+# never change and can be cached forever. Create React App writes
+# asset-manifest.json, Vite (with build.manifest) .vite/manifest.json.
+BUILD_MANIFESTS = ('asset-manifest.json', '.vite/manifest.json', 'manifest.json')
+
+# Without a build manifest: a webpack content hash (main.8a2c9f1e.chunk.js,
+# logo.6ce24c58.svg). At least one hex letter, so dated names like
+# clip.20240115.mp4 don't count.
+HASHED_NAME_RE = re.compile(r'\.(?=[0-9]*[a-f])[0-9a-f]{8,}\.(?:chunk\.)?[A-Za-z0-9]+$')
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml',
+                      'image/svg+xml', 'application/wasm', 'application/manifest+json')
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+
+
+class StaticManifest:
+    """Precomputed index of the built frontend served by the catch-all route
+
+    Every file under the static folder is catalogued once (or again when the
+    folder changes) with its type, ETag and cache policy. Small files are kept
+    in memory together with gzip/brotli variants, so a request is a dict
+    lookup and never touches the filesystem.
+    """
+
+    def __init__(self, root, inline_max_bytes=None, reload_interval=None):
+        self.root = root
+        self.inline_max_bytes = inline_max_bytes or int(os.environ.get('STATIC_INLINE_MAX_BYTES', 512 * 1024))
+        self.reload_interval = float(reload_interval if reload_interval is not None
+                                     else os.environ.get('STATIC_RELOAD_INTERVAL', 0))
+        self.files = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.load()
+
+    def _current_signature(self):
+        # Directory mtimes catch added/removed/renamed files; index.html is
+        # included because it is usually overwritten in place
+        signature = []
+        for directory, _, _ in os.walk(self.root):
+            signature.append(os.stat(directory).st_mtime_ns)
+        index_path = os.path.join(self.root, 'index.html')
+        if os.path.exists(index_path):
+            signature.append(os.stat(index_path).st_mtime_ns)
+        return tuple(signature)
+
+    def _build_hashed_names(self):
+        """Hashed file names listed in the frontend build's manifest, or None without one"""
+        for name in BUILD_MANIFESTS:
+            try:
+                with open(os.path.join(self.root, name)) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not isinstance(manifest, dict):
+                continue
+            if isinstance(manifest.get('files'), dict):
+                # Create React App: {"files": {"main.js": "/static/js/main.8a2c9f1e.js", ...}}
+                paths = list(manifest['files'].values())
+            else:
+                # Vite: {"src/main.jsx": {"file": "assets/index-BQ3x9a1b.js", "css": [...], ...}}
+                chunks = [chunk for chunk in manifest.values() if isinstance(chunk, dict) and 'file' in chunk]
+                if not chunks:
+                    # e.g. the web app manifest.json, which lists no build output
+                    continue
+                paths = [chunk['file'] for chunk in chunks]
+                for chunk in chunks:
+                    paths.extend(chunk.get('css', []) + chunk.get('assets', []))
+            # The manifest also lists the (unhashed) HTML entry points
+            return {p.lstrip('/') for p in paths if isinstance(p, str) and not p.endswith('.html')}
+        return None
+
+    def _cache_control(self, relative, hashed_names):
+        if hashed_names is not None:
+            hashed = relative in hashed_names
+        else:
+            hashed = HASHED_NAME_RE.search(relative) is not None
+        return IMMUTABLE_CACHE if hashed else REVALIDATE_CACHE
+
+    def load(self):
+        """(Re)build the manifest from the static folder"""
+        files = {}
+        if self.root and os.path.isdir(self.root):
+            hashed_names = self._build_hashed_names()
+            for directory, _, names in os.walk(self.root):
+                for name in names:
+                    if name.endswith(('.gz', '.br')):
+                        continue
+                    path = os.path.join(directory, name)
+                    relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+                    files[relative] = self._entry(path, self._cache_control(relative, hashed_names))
+            self._signature = self._current_signature()
+        self.files = files
+        self._checked_at = time.monotonic()
+        return len(files)
+
+    def _entry(self, path, cache_control):
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        size = os.path.getsize(path)
+        entry = {
+            'path': path,
+            'mimetype': mimetype,
+            'size': size,
+            'cache_control': cache_control,
+            'body': None,
+            'variants': {}
+        }
+
+        if size > self.inline_max_bytes:
+            stat = os.stat(path)
+            entry['etag'] = f"{stat.st_mtime_ns:x}-{size:x}"
+            return entry
+
+        with open(path, 'rb') as f:
+            body = f.read()
+        entry['body'] = body
+        entry['etag'] = hashlib.sha256(body).hexdigest()[:32]
+
+        if mimetype.startswith(COMPRESSIBLE_TYPES) and size > 256:
+            for encoding, suffix, compress in (('br', '.br', brotli.compress if brotli else None),
+                                               ('gzip', '.gz', lambda data: gzip.compress(data, 9, mtime=0))):
+                # Prefer variants produced by the frontend build
+                if os.path.exists(path + suffix):
+                    with open(path + suffix, 'rb') as f:
+                        variant = f.read()
+                elif compress is not None:
+                    variant = compress(body)
+                else:
+                    continue
+                if len(variant) < size:
+                    entry['variants'][encoding] = variant
+        return entry
+
+    def _maybe_reload(self):
+        if self.reload_interval <= 0 or time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = time.monotonic()
+            if os.path.isdir(self.root) and self._current_signature() != self._signature:
+                self.load()
+
+    def __contains__(self, path):
+        self._maybe_reload()
+        return path in self.files
+
+    def response(self, path):
+        """Response for a static file, or None if it is not in the manifest"""
+        self._maybe_reload()
+        entry = self.files.get(path)
+        if entry is None:
+            return None
+
+        if entry['body'] is None:
+            response = send_file(entry['path'], mimetype=entry['mimetype'], etag=entry['etag'],
+                                 conditional=True, max_age=None)
+            response.headers['Cache-Control'] = entry['cache_control']
+            return response
+
+        body, etag = entry['body'], entry['etag']
+        encoding = None
+        if entry['variants']:
+            accepted = request.accept_encodings
+            for candidate in ('br', 'gzip'):
+                if candidate in entry['variants'] and accepted[candidate]:
+                    encoding = candidate
+                    body = entry['variants'][candidate]
+                    etag = f"{etag}-{candidate}"
+                    break
+
+        response = Response(body, mimetype=entry['mimetype'])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if entry['variants']:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = entry['cache_control']
+        return response.make_conditional(request)
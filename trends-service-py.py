@@ -0,0 +1,214 @@
+import bisect
+import random
+import threading
+
+
+class _Bucket:
+    """Trending elements kept sorted by popularity (ascending)"""
+
+    def __init__(self):
+        self.popularity = []
+        self.entries = []
+        self._cumulative = None
+
+    def insert(self, entry):
+        i = bisect.bisect_right(self.popularity, entry['popularity'])
+        self.popularity.insert(i, entry['popularity'])
+        self.entries.insert(i, entry)
+        self._cumulative = None
+
+    def remove(self, entry):
+        lo = bisect.bisect_left(self.popularity, entry['popularity'])
+        hi = bisect.bisect_right(self.popularity, entry['popularity'])
+        for i in range(lo, hi):
+            if self.entries[i]['name'] == entry['name']:
+                del self.popularity[i]
+                del self.entries[i]
+                self._cumulative = None
+                return
+
+    def start(self, min_popularity):
+        """Index of the first entry with popularity above min_popularity"""
+        return bisect.bisect_right(self.popularity, min_popularity)
+
+    def cumulative(self):
+        # Prefix sums of popularity for weighted sampling, rebuilt lazily
+        # after the bucket changes
+        if self._cumulative is None:
+            total = 0.0
+            cumulative = []
+            for popularity in self.popularity:
+                total += max(popularity, 0.0)
+                cumulative.append(total)
+            self._cumulative = cumulative
+        return self._cumulative
+
+
+class TrendIndex:
+    """In-memory index of trending elements bucketed by type and category
+
+    Every element sits in a popularity-sorted bucket for its type, its
+    (type, category), all elements and its category alone (None stands for
+    "any"), so a filtered top-k is a slice of one bucket.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._elements = {}
+        self._buckets = {}
+
+    def _bucket_keys(self, entry):
+        element_type, category = entry['type'], entry.get('category')
+        # dict.fromkeys drops the duplicate keys of an element without category
+        return tuple(dict.fromkeys(((element_type, None), (element_type, category), (None, None), (None, category))))
+
+    @staticmethod
+    def _entry(element):
+        return {
+            'name': element['name'],
+            'type': element['type'],
+            'category': element.get('category'),
+            'popularity': float(element.get('popularity') or 0.0)
+        }
+
+    def upsert(self, entry):
+        """Add an element or move it to its new popularity position"""
+        entry = self._entry(entry)
+        with self._lock:
+            self._discard(entry['name'])
+            self._elements[entry['name']] = entry
+            for key in self._bucket_keys(entry):
+                self._buckets.setdefault(key, _Bucket()).insert(entry)
+
+    def remove(self, name):
+        """Drop an element from the index"""
+        with self._lock:
+            self._discard(name)
+
+    def _discard(self, name):
+        old = self._elements.pop(name, None)
+        if old is not None:
+            for key in self._bucket_keys(old):
+                self._buckets[key].remove(old)
+
+    def load(self, elements, element_type=None):
+        """Bulk load elements, e.g. a static catalog list of one type
+
+        The buckets are rebuilt with one sort instead of one sorted insert
+        per element, which is quadratic for a large catalog.
+        """
+        with self._lock:
+            for element in elements:
+                if element_type is not None:
+                    element = dict(element, type=element_type)
+                entry = self._entry(element)
+                self._elements[entry['name']] = entry
+            self._rebuild()
+
+    def _rebuild(self):
+        groups = {}
+        for entry in sorted(self._elements.values(), key=lambda e: e['popularity']):
+            for key in self._bucket_keys(entry):
+                groups.setdefault(key, []).append(entry)
+        buckets = {}
+        for key, entries in groups.items():
+            bucket = buckets[key] = _Bucket()
+            bucket.entries = entries
+            bucket.popularity = [entry['popularity'] for entry in entries]
+        self._buckets = buckets
+
+    def clear(self):
+        with self._lock:
+            self._elements.clear()
+            self._buckets.clear()
+
+    def above(self, element_type, min_popularity=0, category=None):
+        """Elements of a type (and optional category) more popular than min_popularity, most popular last"""
+        with self._lock:
+            bucket = self._buckets.get((element_type, category))
+            if bucket is None:
+                return []
+            return bucket.entries[bucket.start(min_popularity):]
+
+    def count_above(self, element_type, min_popularity=0, category=None):
+        with self._lock:
+            bucket = self._buckets.get((element_type, category))
+            if bucket is None:
+                return 0
+            return len(bucket.entries) - bucket.start(min_popularity)
+
+    def sample(self, element_type, min_popularity=0, category=None, rng=random):
+        """Pick one element above the threshold, weighted by popularity"""
+        with self._lock:
+            bucket = self._buckets.get((element_type, category))
+            if bucket is None:
+                return None
+            start = bucket.start(min_popularity)
+            if start >= len(bucket.entries):
+                return None
+
+            cumulative = bucket.cumulative()
+            low = cumulative[start - 1] if start else 0.0
+            high = cumulative[-1]
+            if high <= low:
+                return bucket.entries[start + int(rng.random() * (len(bucket.entries) - start))]
+
+            target = low + rng.random() * (high - low)
+            i = bisect.bisect_right(cumulative, target, lo=start)
+            return bucket.entries[min(i, len(bucket.entries) - 1)]
+
+    def top(self, element_type=None, k=5, category=None):
+        """The k most popular elements of a type and/or category (None = any), most popular first"""
+        with self._lock:
+            bucket = self._buckets.get((element_type, category))
+            if bucket is None or k <= 0:
+                return []
+            return bucket.entries[max(0, len(bucket.entries) - k):][::-1]
+
+    def get(self, name):
+        with self._lock:
+            return self._elements.get(name)
+
+    def __len__(self):
+        return len(self._elements)
+
+
+def element_entry(element):
+    """Index entry for a TrendingElement row"""
+    return {
+        'name': element.name,
+        'type': element.type,
+        'category': element.category,
+        'popularity': element.popularity
+    }
+
+
+def _on_popularity_change(element):
+    if element.is_active:
+        trend_index.upsert(element_entry(element))
+    else:
+        trend_index.remove(element.name)
+
+
+def sync_with_database():
+    """Merge TrendingElement rows into the index and keep it updated as popularity changes
+
+    Must run inside an application context. Active rows are added to (or
+    replace) the built-in catalog entries of the same name, inactive ones are
+    dropped from it. Returns the number of active rows loaded.
+    """
+    from src.models.user import TrendingElement, db, popularity_listeners
+
+    if _on_popularity_change not in popularity_listeners:
+        popularity_listeners.append(_on_popularity_change)
+
+    rows = TrendingElement.query.filter_by(is_active=True).all()
+    inactive = [name for name, in db.session.query(TrendingElement.name).filter_by(is_active=False)]
+    with trend_index._lock:
+        for name in inactive:
+            trend_index._elements.pop(name, None)
+        trend_index.load([element_entry(row) for row in rows])
+    return len(rows)
+
+
+trend_index = TrendIndex()
@@ -1,10 +1,157 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from datetime import datetime, timedelta, timezone
+import atexit
 import json
+import logging
+import os
+import threading
+import time
+from src.services.passwords import password_hasher
+from src.services.trends import trend_index
 
 db = SQLAlchemy()
 
+logger = logging.getLogger(__name__)
+
+# Callables run with the element after its popularity changes
+# (e.g. to keep the in-memory trend index in step with the table)
+popularity_listeners = []
+
+# Callables run with {trending_element_id: generations} for every chunk of
+# generations record_generations stores (e.g. to sample trend usage)
+generation_listeners = []
+
+class CounterBuffer:
+    """Write-behind buffer for counter columns
+
+    Increments and assignments are aggregated per row in memory and written
+    in one transaction (one executemany UPDATE per model and column set) once
+    max_pending rows are dirty or flush_interval seconds have passed.
+    Until init_app() is called every change is flushed immediately.
+    """
+    
+    def __init__(self, max_pending=None, flush_interval=None):
+        self.max_pending = max_pending or int(os.environ.get('COUNTER_FLUSH_SIZE', 500))
+        self.flush_interval = flush_interval or float(os.environ.get('COUNTER_FLUSH_INTERVAL', 5))
+        self._increments = {}
+        self._assignments = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._app = None
+        self._pid = None
+    
+    def init_app(self, app):
+        """Buffer writes for this app and flush them on interpreter shutdown"""
+        self._app = app
+        atexit.register(self.flush)
+    
+    def increment(self, model, row_id, **deltas):
+        """Add deltas to counter columns of a row"""
+        with self._lock:
+            pending = self._increments.setdefault((model, row_id), {})
+            for column, delta in deltas.items():
+                pending[column] = pending.get(column, 0) + delta
+        self._after_write()
+    
+    def assign(self, model, row_id, **values):
+        """Set columns of a row, last write wins"""
+        with self._lock:
+            self._assignments.setdefault((model, row_id), {}).update(values)
+        self._after_write()
+    
+    def pending(self, model, row_id):
+        """Unflushed (increments, assignments) for a row, for read-your-writes"""
+        with self._lock:
+            return (dict(self._increments.get((model, row_id), {})),
+                    dict(self._assignments.get((model, row_id), {})))
+    
+    def _after_write(self):
+        if self._app is None:
+            self.flush()
+            return
+        self._ensure_timer()
+        if len(self._increments) + len(self._assignments) >= self.max_pending:
+            # The caller's own write has already committed, so a failed flush
+            # must not fail its request: the changes stay queued for a retry
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Counter flush failed')
+    
+    def _ensure_timer(self):
+        # Started lazily so each forked worker runs its own flusher
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run_timer, name='counter-flush', daemon=True).start()
+    
+    def _run_timer(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Counter flush failed')
+    
+    def flush(self):
+        """Write all pending changes in a single transaction"""
+        with self._flush_lock:
+            with self._lock:
+                increments, self._increments = self._increments, {}
+                assignments, self._assignments = self._assignments, {}
+            if not increments and not assignments:
+                return 0
+            
+            groups = {}
+            for key in set(increments) | set(assignments):
+                model, row_id = key
+                deltas = increments.get(key, {})
+                values = assignments.get(key, {})
+                params = {'row_id': row_id}
+                params.update({f'delta_{c}': v for c, v in deltas.items()})
+                params.update({f'value_{c}': v for c, v in values.items()})
+                group = (model, tuple(sorted(deltas)), tuple(sorted(values)))
+                groups.setdefault(group, []).append(params)
+            
+            try:
+                if self._app is not None:
+                    with self._app.app_context():
+                        self._write(groups)
+                else:
+                    self._write(groups)
+            except Exception:
+                # Put the changes back so the next flush retries them
+                with self._lock:
+                    for key, deltas in increments.items():
+                        pending = self._increments.setdefault(key, {})
+                        for column, delta in deltas.items():
+                            pending[column] = pending.get(column, 0) + delta
+                    for key, values in assignments.items():
+                        # Values assigned since the failed flush are newer
+                        values = dict(values)
+                        values.update(self._assignments.get(key, {}))
+                        self._assignments[key] = values
+                raise
+            return len(set(increments) | set(assignments))
+    
+    def _write(self, groups):
+        for (model, delta_columns, value_columns), params in groups.items():
+            table = model.__table__
+            values = {c: table.c[c] + bindparam(f'delta_{c}') for c in delta_columns}
+            values.update({c: bindparam(f'value_{c}') for c in value_columns})
+            statement = table.update().where(table.c.id == bindparam('row_id')).values(values)
+            db.session.execute(statement, params)
+        db.session.commit()
+
+
+counter_buffer = CounterBuffer()
+
 class User(db.Model):
     """User model for storing user information"""
     __tablename__ = 'users'
@@ -19,55 +166,85 @@ class User(db.Model):
     
     # Profile information
     bio = db.Column(db.Text)
-    favorite_categories = db.Column(db.Text)  # JSON string
+    favorite_categories = db.Column(db.Text)  # Legacy JSON string, see migrate_json_columns
     subscription_plan = db.Column(db.String(20), default='free')
     
     # Usage statistics
     videos_generated = db.Column(db.Integer, default=0)
     total_viral_score = db.Column(db.Float, default=0.0)
     
-    # Relationships
-    video_history = db.relationship('VideoHistory', backref='user', lazy=True, cascade='all, delete-orphan')
+    # Relationships (dynamic: heavy users have tens of thousands of rows,
+    # page through them with VideoHistory.page_for_user instead)
+    video_history = db.relationship('VideoHistory', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    favorite_category_links = db.relationship('UserFavoriteCategory', lazy='selectin',
+                                              order_by='UserFavoriteCategory.position',
+                                              cascade='all, delete-orphan')
     
     def __init__(self, username, email, password):
         self.username = username
         self.email = email
         self.set_password(password)
     
+    @classmethod
+    def from_token_subject(cls, subject):
+        """Find the user for a JWT user_id claim of the form user_<username>_<timestamp>"""
+        if not subject or not subject.startswith('user_'):
+            return None
+        username = subject[len('user_'):].rsplit('_', 1)[0]
+        return cls.query.filter_by(username=username).first()
+    
     def set_password(self, password):
         """Set password hash"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
         """Check if password is correct"""
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.check(self.password_hash, password)
+    
+    def check_and_upgrade_password(self, password):
+        """Check the password and rehash it if the stored cost parameters are outdated"""
+        if not self.check_password(password):
+            return False
+        if password_hasher.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
     
     def get_favorite_categories(self):
         """Get favorite categories as list"""
-        if self.favorite_categories:
-            try:
-                return json.loads(self.favorite_categories)
-            except json.JSONDecodeError:
-                return []
-        return []
+        if self.favorite_category_links:
+            return [link.category for link in self.favorite_category_links]
+        return _load_json_list(self.favorite_categories)
     
     def set_favorite_categories(self, categories):
         """Set favorite categories from list"""
-        self.favorite_categories = json.dumps(categories) if categories else None
+        self.favorite_category_links = [
+            UserFavoriteCategory(category=category, position=i)
+            for i, category in enumerate(dict.fromkeys(categories or []))
+        ]
+        self.favorite_categories = None
+    
+    def get_stats(self, include_pending=False):
+        """Get (videos_generated, total_viral_score), optionally with unflushed updates"""
+        videos_generated = self.videos_generated or 0
+        total_viral_score = self.total_viral_score or 0.0
+        if include_pending:
+            deltas, _ = counter_buffer.pending(User, self.id)
+            videos_generated += deltas.get('videos_generated', 0)
+            total_viral_score += deltas.get('total_viral_score', 0.0)
+        return videos_generated, total_viral_score
     
-    def get_average_viral_score(self):
+    def get_average_viral_score(self, include_pending=False):
         """Calculate average viral score"""
-        if self.videos_generated > 0:
-            return round(self.total_viral_score / self.videos_generated, 1)
+        videos_generated, total_viral_score = self.get_stats(include_pending)
+        if videos_generated > 0:
+            return round(total_viral_score / videos_generated, 1)
         return 0.0
     
     def update_stats(self, viral_score):
-        """Update user statistics"""
-        self.videos_generated += 1
-        self.total_viral_score += viral_score
-        db.session.commit()
+        """Update user statistics (buffered, see CounterBuffer)"""
+        counter_buffer.increment(User, self.id, videos_generated=1, total_viral_score=viral_score)
     
-    def to_dict(self):
+    def to_dict(self, include_pending=False):
         """Convert user to dictionary"""
         return {
             'id': self.id,
@@ -78,8 +255,8 @@ class User(db.Model):
             'bio': self.bio,
             'favorite_categories': self.get_favorite_categories(),
             'subscription_plan': self.subscription_plan,
-            'videos_generated': self.videos_generated,
-            'average_viral_score': self.get_average_viral_score(),
+            'videos_generated': self.get_stats(include_pending)[0],
+            'average_viral_score': self.get_average_viral_score(include_pending),
             'is_active': self.is_active
         }
     
@@ -89,43 +266,80 @@ class User(db.Model):
 class VideoHistory(db.Model):
     """Model for storing user's video generation history"""
     __tablename__ = 'video_history'
+    __table_args__ = (
+        # Keyset pagination of a user's history, optionally by category
+        db.Index('ix_video_history_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_video_history_user_category_created', 'user_id', 'content_category', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     prompt = db.Column(db.Text, nullable=False)
     description = db.Column(db.Text)
-    applied_trends = db.Column(db.Text)  # JSON string
+    applied_trends = db.Column(db.Text)  # Legacy JSON string, see migrate_json_columns
     viral_score = db.Column(db.Float, default=0.0)
     content_category = db.Column(db.String(50))
-    suggested_platforms = db.Column(db.Text)  # JSON string
+    suggested_platforms = db.Column(db.Text)  # Legacy JSON string, see migrate_json_columns
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_favorite = db.Column(db.Boolean, default=False)
     
+    # Normalized trends and platforms, loaded for a whole page in one query each
+    trend_links = db.relationship('VideoHistoryTrend', lazy='selectin',
+                                  order_by='VideoHistoryTrend.position',
+                                  cascade='all, delete-orphan')
+    platform_links = db.relationship('VideoHistoryPlatform', lazy='selectin',
+                                     order_by='VideoHistoryPlatform.position',
+                                     cascade='all, delete-orphan')
+    
     def get_applied_trends(self):
         """Get applied trends as list"""
-        if self.applied_trends:
-            try:
-                return json.loads(self.applied_trends)
-            except json.JSONDecodeError:
-                return []
-        return []
+        if self.trend_links:
+            return [link.element.name for link in self.trend_links]
+        return _load_json_list(self.applied_trends)
     
     def set_applied_trends(self, trends):
-        """Set applied trends from list"""
-        self.applied_trends = json.dumps(trends) if trends else None
+        """Set applied trends from a list of names or trend dicts"""
+        elements = TrendingElement.get_or_create_many(trends or [])
+        self.trend_links = [
+            VideoHistoryTrend(element=element, position=i) for i, element in enumerate(elements)
+        ]
+        self.applied_trends = None
     
     def get_suggested_platforms(self):
         """Get suggested platforms as list"""
-        if self.suggested_platforms:
-            try:
-                return json.loads(self.suggested_platforms)
-            except json.JSONDecodeError:
-                return []
-        return []
+        if self.platform_links:
+            return [link.platform.name for link in self.platform_links]
+        return _load_json_list(self.suggested_platforms)
     
     def set_suggested_platforms(self, platforms):
         """Set suggested platforms from list"""
-        self.suggested_platforms = json.dumps(platforms) if platforms else None
+        platforms = Platform.get_or_create_many(platforms or [])
+        self.platform_links = [
+            VideoHistoryPlatform(platform=platform, position=i) for i, platform in enumerate(platforms)
+        ]
+        self.suggested_platforms = None
+    
+    @classmethod
+    def page_for_user(cls, user_id, limit=20, before=None, category=None):
+        """Newest-first page of a user's history
+
+        before is the (created_at, id) of the last row of the previous page.
+        Returns (rows, has_more); each page is an index range scan, so its
+        cost does not depend on how deep into the history it is.
+        """
+        query = cls.query.filter(cls.user_id == user_id)
+        if category:
+            query = query.filter(cls.content_category == category)
+        if before is not None:
+            created_at, row_id = before
+            # A row-value comparison is a single seek on the (user_id, created_at, id)
+            # index; the redundant created_at bound helps planners without row values
+            query = query.filter(
+                cls.created_at <= created_at,
+                db.tuple_(cls.created_at, cls.id) < db.tuple_(created_at, row_id)
+            )
+        rows = query.order_by(cls.created_at.desc(), cls.id.desc()).limit(limit + 1).all()
+        return rows[:limit], len(rows) > limit
     
     def to_dict(self):
         """Convert video history to dictionary"""
@@ -141,6 +355,37 @@ class VideoHistory(db.Model):
             'is_favorite': self.is_favorite
         }
     
+    @classmethod
+    def iter_export(cls, user_id, batch_size=500):
+        """Yield a user's whole history as to_dict() dicts, oldest first
+        
+        Rows are read from a server-side cursor (stream_results) batch_size at
+        a time and the trends and platforms of each batch are loaded with one
+        query each, so memory use does not grow with the size of the history.
+        """
+        table = cls.__table__
+        query = (db.select(table)
+                 .where(table.c.user_id == user_id)
+                 .order_by(table.c.created_at, table.c.id))
+        with db.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+            for rows in result.partitions():
+                ids = [row.id for row in rows]
+                trends = _linked_names(VideoHistoryTrend, TrendingElement, 'trending_element_id', ids)
+                platforms = _linked_names(VideoHistoryPlatform, Platform, 'platform_id', ids)
+                for row in rows:
+                    yield {
+                        'id': row.id,
+                        'prompt': row.prompt,
+                        'description': row.description,
+                        'applied_trends': trends.get(row.id) or _load_json_list(row.applied_trends),
+                        'viral_score': row.viral_score,
+                        'content_category': row.content_category,
+                        'suggested_platforms': platforms.get(row.id) or _load_json_list(row.suggested_platforms),
+                        'created_at': row.created_at.isoformat() if row.created_at else None,
+                        'is_favorite': row.is_favorite
+                    }
+    
     def __repr__(self):
         return f'<VideoHistory {self.id}: {self.prompt[:50]}...>'
 
@@ -158,30 +403,490 @@ class TrendingElement(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    @classmethod
+    def get_or_create_many(cls, trends):
+        """Resolve trend names (or dicts with name/type/category/popularity) to rows, creating missing ones
+        
+        A missing row takes its type, category and popularity from the dict or
+        else from the trend index. Names neither knows are stored inactive, so
+        the history keeps them but the index never loads them.
+        """
+        trends = [t if isinstance(t, dict) else {'name': t} for t in trends]
+        names = list(dict.fromkeys(t['name'] for t in trends))
+        existing = {e.name: e for e in cls.query.filter(cls.name.in_(names))} if names else {}
+        for trend in trends:
+            if trend['name'] not in existing:
+                if 'type' not in trend:
+                    trend = trend_index.get(trend['name']) or dict(trend, type='unknown', is_active=False)
+                element = cls(
+                    name=trend['name'],
+                    type=trend['type'],
+                    category=trend.get('category'),
+                    popularity=trend.get('popularity') or 0.0,
+                    is_active=trend.get('is_active', True)
+                )
+                db.session.add(element)
+                existing[element.name] = element
+        return [existing[name] for name in names]
+    
+    @classmethod
+    def generation_counts(cls, limit=None):
+        """(name, type, generations) for the most applied trends, aggregated in SQL"""
+        generations = db.func.count(VideoHistoryTrend.video_history_id)
+        query = (db.session.query(cls.name, cls.type, generations)
+                 .join(VideoHistoryTrend, VideoHistoryTrend.trending_element_id == cls.id)
+                 .group_by(cls.id)
+                 .order_by(generations.desc()))
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+    
     def update_popularity(self, new_popularity):
-        """Update popularity score"""
-        self.popularity = new_popularity
-        self.updated_at = datetime.utcnow()
-        db.session.commit()
+        """Update popularity score (buffered, see CounterBuffer)"""
+        now = datetime.utcnow()
+        counter_buffer.assign(TrendingElement, self.id, popularity=new_popularity, updated_at=now)
+        # Reflect the new value on this instance without marking it dirty
+        set_committed_value(self, 'popularity', new_popularity)
+        set_committed_value(self, 'updated_at', now)
+        for listener in popularity_listeners:
+            listener(self)
     
     def increment_usage(self):
-        """Increment usage count"""
-        self.usage_count += 1
-        db.session.commit()
+        """Increment usage count (buffered, see CounterBuffer)"""
+        counter_buffer.increment(TrendingElement, self.id, usage_count=1)
     
-    def to_dict(self):
+    def get_usage_count(self, include_pending=False):
+        """Get usage count, optionally with unflushed increments"""
+        usage_count = self.usage_count or 0
+        if include_pending:
+            deltas, _ = counter_buffer.pending(TrendingElement, self.id)
+            usage_count += deltas.get('usage_count', 0)
+        return usage_count
+    
+    def get_popularity(self, include_pending=False):
+        """Get popularity, optionally with an unflushed update"""
+        if include_pending:
+            _, values = counter_buffer.pending(TrendingElement, self.id)
+            return values.get('popularity', self.popularity)
+        return self.popularity
+    
+    def to_dict(self, include_pending=False):
         """Convert trending element to dictionary"""
         return {
             'id': self.id,
             'name': self.name,
             'type': self.type,
             'category': self.category,
-            'popularity': self.popularity,
-            'usage_count': self.usage_count,
+            'popularity': self.get_popularity(include_pending),
+            'usage_count': self.get_usage_count(include_pending),
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
     
     def __repr__(self):
-        return f'<TrendingElement {self.name} ({self.type})>'
\ No newline at end of file
+        return f'<TrendingElement {self.name} ({self.type})>'
+
+class TrendingElementSample(db.Model):
+    """Popularity of a trending element at one point in time (see src/services/popularity.py)"""
+    __tablename__ = 'trending_element_samples'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    trending_element_id = db.Column(db.Integer, db.ForeignKey('trending_elements.id', ondelete='CASCADE'),
+                                    nullable=False, index=True)
+    popularity = db.Column(db.Float, nullable=False)
+    recorded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class RevokedToken(db.Model):
+    """Digest of a revoked JWT, kept until the token expires (see TokenCache in src/routes/user.py)"""
+    __tablename__ = 'revoked_tokens'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.LargeBinary(32), nullable=False, unique=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class UserFavoriteCategory(db.Model):
+    """A user's favorite content category"""
+    __tablename__ = 'user_favorite_categories'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+
+class Platform(db.Model):
+    """Model for publishing platforms suggested for generated videos"""
+    __tablename__ = 'platforms'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+    
+    @classmethod
+    def get_or_create_many(cls, names):
+        """Resolve platform names to rows, creating unknown ones"""
+        names = list(dict.fromkeys(names))
+        existing = {p.name: p for p in cls.query.filter(cls.name.in_(names))} if names else {}
+        for name in names:
+            if name not in existing:
+                existing[name] = cls(name=name)
+                db.session.add(existing[name])
+        return [existing[name] for name in names]
+    
+    def __repr__(self):
+        return f'<Platform {self.name}>'
+
+class VideoHistoryTrend(db.Model):
+    """Trending element applied to a generated video"""
+    __tablename__ = 'video_history_trends'
+    __table_args__ = (
+        # "How many generations used trend X" without a table scan
+        db.Index('ix_video_history_trends_element', 'trending_element_id', 'video_history_id'),
+    )
+    
+    video_history_id = db.Column(db.Integer, db.ForeignKey('video_history.id', ondelete='CASCADE'), primary_key=True)
+    trending_element_id = db.Column(db.Integer, db.ForeignKey('trending_elements.id'), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    # The element's popularity when the video was generated (None for imported history)
+    popularity = db.Column(db.Float)
+    
+    element = db.relationship('TrendingElement', lazy='joined')
+
+class VideoHistoryPlatform(db.Model):
+    """Platform suggested for a generated video"""
+    __tablename__ = 'video_history_platforms'
+    __table_args__ = (
+        db.Index('ix_video_history_platforms_platform', 'platform_id', 'video_history_id'),
+    )
+    
+    video_history_id = db.Column(db.Integer, db.ForeignKey('video_history.id', ondelete='CASCADE'), primary_key=True)
+    platform_id = db.Column(db.Integer, db.ForeignKey('platforms.id'), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    
+    platform = db.relationship('Platform', lazy='joined')
+
+class CategoryDailyRollup(db.Model):
+    """Generations and summed viral scores per content category and UTC day
+
+    Kept up to date by record_generations, so analytics read a few rows per
+    category instead of aggregating video_history.
+    """
+    __tablename__ = 'category_daily_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'category', name='uq_category_daily_rollups_day_category'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    category = db.Column(db.String(50), nullable=False)
+    generations = db.Column(db.Integer, nullable=False, default=0)
+    viral_score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    
+    # (day, category) -> id, so recording a generation doesn't look the row up.
+    # Rows are never deleted (backfill updates them in place), so cached ids
+    # stay valid in every worker
+    _ids = {}
+    
+    @classmethod
+    def row_id(cls, day, category):
+        """Id of the rollup row for a day and category, creating it if needed"""
+        key = (day, category)
+        row_id = cls._ids.get(key)
+        if row_id is None:
+            row = cls.query.filter_by(day=day, category=category).first()
+            if row is None:
+                try:
+                    with db.session.begin_nested():
+                        row = cls(day=day, category=category, generations=0, viral_score_sum=0.0)
+                        db.session.add(row)
+                except IntegrityError:
+                    # Created by another worker in the meantime
+                    row = cls.query.filter_by(day=day, category=category).one()
+            row_id = cls._ids[key] = row.id
+        return row_id
+    
+    @classmethod
+    def totals_since(cls, start_day):
+        """{(day, category): [generations, viral_score_sum]} from start_day on, with unflushed counts"""
+        totals = {}
+        for row in cls.query.filter(cls.day >= start_day):
+            deltas, _ = counter_buffer.pending(cls, row.id)
+            totals[(row.day, row.category)] = [
+                row.generations + deltas.get('generations', 0),
+                row.viral_score_sum + deltas.get('viral_score_sum', 0.0)
+            ]
+        return totals
+    
+    @classmethod
+    def backfill(cls, before=None):
+        """Recompute the rollups of days before `before` from video_history
+        
+        Returns (number of (day, category) rows, cut-off day). Other workers
+        may still hold buffered increments for recent days, which would be
+        counted twice once they flush on top of a recomputed row, so days
+        from the cut-off on are left alone. The default cut-off is the UTC
+        day two flush intervals ago: every increment for an earlier day has
+        been flushed by then, unless an import of old history is running.
+        Existing rows are updated in place, so ids cached by running workers
+        stay valid.
+        """
+        if before is None:
+            before = (datetime.utcnow() - timedelta(seconds=2 * counter_buffer.flush_interval)).date()
+        counter_buffer.flush()
+        day = db.func.date(VideoHistory.created_at)
+        category = db.func.coalesce(VideoHistory.content_category, 'general')
+        totals = {}
+        for value, name, generations, viral_score_sum in (
+                db.session.query(day, category, db.func.count(VideoHistory.id), db.func.sum(VideoHistory.viral_score))
+                .filter(VideoHistory.created_at < datetime(before.year, before.month, before.day))
+                .group_by(day, category)):
+            # SQLite returns date() as text
+            if isinstance(value, str):
+                value = datetime.strptime(value, '%Y-%m-%d').date()
+            totals[(value, name)] = (generations, viral_score_sum or 0.0)
+        
+        for row in cls.query.filter(cls.day < before):
+            row.generations, row.viral_score_sum = totals.pop((row.day, row.category), (0, 0.0))
+        for (value, name), (generations, viral_score_sum) in totals.items():
+            # row_id copes with a worker creating the row concurrently
+            cls.query.filter_by(id=cls.row_id(value, name)).update(
+                {'generations': generations, 'viral_score_sum': viral_score_sum})
+        db.session.commit()
+        return cls.query.filter(cls.day < before, cls.generations > 0).count(), before
+
+def record_generations(user, generations, chunk_size=500):
+    """Store (prompt, concept) results in a user's history and update the counters
+    
+    Goes through the same bulk insert as import_history, so a batch costs a
+    few statements per chunk instead of several per generation. The trend
+    usage of each chunk is passed to generation_listeners.
+    """
+    now = datetime.utcnow()
+    records = [
+        ({
+            'prompt': prompt,
+            'description': concept['description'],
+            'applied_trends': None,
+            'viral_score': concept['estimatedViralScore'],
+            'content_category': concept['contentCategory'],
+            'suggested_platforms': None,
+            'created_at': now,
+            'is_favorite': False
+        }, concept['appliedTrends'], concept['suggestedPlatforms'])
+        for prompt, concept in generations if concept.get('success')
+    ]
+    popularity = {}
+    for _, trends, _ in records:
+        for name in trends:
+            entry = trend_index.get(name)
+            if entry is not None:
+                popularity[name] = entry['popularity']
+    for start in range(0, len(records), chunk_size):
+        usage = _import_history_chunk(user, records[start:start + chunk_size], popularity)
+        for listener in generation_listeners:
+            listener(usage)
+    return len(records)
+
+def _linked_names(link_model, target_model, foreign_key, history_ids):
+    """{video_history_id: [names in position order]} for a batch of history rows"""
+    if not history_ids:
+        return {}
+    links = link_model.__table__
+    targets = target_model.__table__
+    query = (db.select(links.c.video_history_id, targets.c.name)
+             .join_from(links, targets, links.c[foreign_key] == targets.c.id)
+             .where(links.c.video_history_id.in_(history_ids))
+             .order_by(links.c.video_history_id, links.c.position))
+    names = {}
+    for history_id, name in db.session.execute(query):
+        names.setdefault(history_id, []).append(name)
+    return names
+
+def _name_list(value, field):
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(name, str) and name.strip() for name in value):
+        raise ValueError(f'{field} must be a list of names')
+    return list(dict.fromkeys(name.strip() for name in value))
+
+def parse_history_record(record):
+    """Validate an exported history record (see VideoHistory.to_dict) for import
+    
+    Returns (video_history row values, trend names, platform names); raises
+    ValueError naming the offending field. The record's id is ignored.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('record must be an object')
+    prompt = record.get('prompt')
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError('prompt is required')
+    description = record.get('description')
+    if description is not None and not isinstance(description, str):
+        raise ValueError('description must be a string')
+    category = record.get('content_category')
+    if category is not None and (not isinstance(category, str) or len(category) > 50):
+        raise ValueError('content_category must be a string of at most 50 characters')
+    try:
+        viral_score = float(record.get('viral_score') or 0.0)
+    except (TypeError, ValueError):
+        raise ValueError('viral_score must be a number')
+    if not 0 <= viral_score <= 100:
+        raise ValueError('viral_score must be between 0 and 100')
+    created_at = record.get('created_at')
+    if created_at is None:
+        created_at = datetime.utcnow()
+    else:
+        try:
+            created_at = datetime.fromisoformat(str(created_at).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('created_at must be an ISO 8601 timestamp')
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    is_favorite = record.get('is_favorite') or False
+    if not isinstance(is_favorite, bool):
+        raise ValueError('is_favorite must be true or false')
+    
+    values = {
+        'prompt': prompt,
+        'description': description,
+        'applied_trends': None,
+        'viral_score': viral_score,
+        'content_category': category,
+        'suggested_platforms': None,
+        'created_at': created_at,
+        'is_favorite': is_favorite
+    }
+    return (values, _name_list(record.get('applied_trends'), 'applied_trends'),
+            _name_list(record.get('suggested_platforms'), 'suggested_platforms'))
+
+def import_history(user, records, chunk_size=500, trend_popularity=None):
+    """Bulk insert parsed history records (see parse_history_record); returns the number imported
+    
+    trend_popularity maps trend names to the popularity they had when the
+    records were generated; it is stored with the trend links.
+    
+    Each chunk is one transaction: trend and platform names are resolved with
+    one query each, the history rows go in with one multi-row INSERT ...
+    RETURNING (an executemany plus one id query on SQLite), their trend and
+    platform links with one executemany each, and the user, trend and rollup
+    counters get one buffered increment per row per chunk. Chunks committed
+    before a failure stay imported.
+    """
+    imported = 0
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            _import_history_chunk(user, chunk, trend_popularity or {})
+            imported += len(chunk)
+            chunk = []
+    if chunk:
+        _import_history_chunk(user, chunk, trend_popularity or {})
+        imported += len(chunk)
+    return imported
+
+def _import_history_chunk(user, chunk, trend_popularity):
+    """Insert one chunk in one transaction; returns {trending_element_id: generations}"""
+    table = VideoHistory.__table__
+    rollups = {}
+    try:
+        elements = TrendingElement.get_or_create_many(
+            list(dict.fromkeys(name for _, trends, _ in chunk for name in trends)))
+        platforms = Platform.get_or_create_many([name for _, _, names in chunk for name in names])
+        db.session.flush()
+        # Plain ids, so nothing is reloaded once the commit expires the rows
+        element_ids = {e.name: e.id for e in elements}
+        platform_ids = {p.name: p.id for p in platforms}
+        
+        rows = [dict(values, user_id=user.id) for values, _, _ in chunk]
+        insert = table.insert()
+        if db.engine.dialect.name == 'sqlite':
+            # SQLite can't match RETURNING rows to parameter sets, so SQLAlchemy
+            # would send one INSERT per row. The transaction holds the write lock
+            # from its first insert and SQLite numbers each new row max(id) + 1,
+            # so the chunk's rows are the highest ids, in order.
+            db.session.execute(insert, rows)
+            ids = db.session.execute(
+                db.select(table.c.id).order_by(table.c.id.desc()).limit(len(rows))).scalars().all()[::-1]
+        elif db.engine.dialect.insert_executemany_returning_sort_by_parameter_order:
+            ids = db.session.execute(insert.returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+        else:
+            # No INSERT ... RETURNING (e.g. MySQL): one statement per row
+            ids = [db.session.execute(insert, row).inserted_primary_key[0] for row in rows]
+        
+        trend_links = [
+            {'video_history_id': history_id, 'trending_element_id': element_ids[name], 'position': i,
+             'popularity': trend_popularity.get(name)}
+            for history_id, (_, trends, _) in zip(ids, chunk) for i, name in enumerate(trends)
+        ]
+        platform_links = [
+            {'video_history_id': history_id, 'platform_id': platform_ids[name], 'position': i}
+            for history_id, (_, _, names) in zip(ids, chunk) for i, name in enumerate(names)
+        ]
+        if trend_links:
+            db.session.execute(VideoHistoryTrend.__table__.insert(), trend_links)
+        if platform_links:
+            db.session.execute(VideoHistoryPlatform.__table__.insert(), platform_links)
+        
+        for values, _, _ in chunk:
+            key = (values['created_at'].date(), values['content_category'] or 'general')
+            totals = rollups.setdefault(key, [0, 0.0])
+            totals[0] += 1
+            totals[1] += values['viral_score']
+        # Resolved before the commit, so rollup rows created here are committed too
+        rollup_ids = {key: CategoryDailyRollup.row_id(*key) for key in rollups}
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Ids of rollup rows created in the rolled back transaction are gone
+        for key in rollups:
+            CategoryDailyRollup._ids.pop(key, None)
+        raise
+    
+    usage = {}
+    for _, trends, _ in chunk:
+        for name in trends:
+            usage[element_ids[name]] = usage.get(element_ids[name], 0) + 1
+    counter_buffer.increment(User, user.id, videos_generated=len(chunk),
+                             total_viral_score=sum(values['viral_score'] for values, _, _ in chunk))
+    for element_id, count in usage.items():
+        counter_buffer.increment(TrendingElement, element_id, usage_count=count)
+    for key, (generations, score_sum) in rollups.items():
+        counter_buffer.increment(CategoryDailyRollup, rollup_ids[key],
+                                 generations=generations, viral_score_sum=score_sum)
+    return usage
+
+def _load_json_list(value):
+    """Decode a legacy JSON list column"""
+    if value:
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return []
+    return []
+
+def migrate_json_columns(batch_size=500):
+    """Move legacy JSON list columns into the association tables
+
+    Walks the rows that still have JSON in batches by primary key and commits
+    each batch, so it can be stopped and re-run. Returns the number of rows
+    migrated.
+    """
+    migrated = 0
+    for model, columns in ((VideoHistory, ('applied_trends', 'suggested_platforms')),
+                           (User, ('favorite_categories',))):
+        pending = db.or_(*[getattr(model, c).isnot(None) for c in columns])
+        last_id = 0
+        while True:
+            rows = (model.query.filter(pending, model.id > last_id)
+                    .order_by(model.id).limit(batch_size).all())
+            if not rows:
+                break
+            for row in rows:
+                if model is VideoHistory:
+                    row.set_applied_trends(_load_json_list(row.applied_trends))
+                    row.set_suggested_platforms(_load_json_list(row.suggested_platforms))
+                else:
+                    row.set_favorite_categories(_load_json_list(row.favorite_categories))
+            db.session.commit()
+            migrated += len(rows)
+            last_id = rows[-1].id
+    return migrated